@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# Benchmark for keyword_matcher: time to match a batch of entry texts against
+# keyword lists of growing size, with the plain per-keyword scan and with the
+# compiled automaton. Texts contain none of the keywords, which is the common
+# case (most entries are kept) and the worst case for the plain scan.
+
+import argparse
+import random
+import string
+import time
+
+from keyword_matcher import compile_keywords, first_match
+
+
+def _word(rng, alphabet, lo=4, hi=10):
+    return "".join(rng.choices(alphabet, k=rng.randint(lo, hi)))
+
+
+def run(entries, words_per_entry, sizes, seed=1):
+    rng = random.Random(seed)
+    vocab = [_word(rng, string.ascii_lowercase) for _ in range(20000)]
+    texts = [" ".join(rng.choices(vocab, k=words_per_entry)) for _ in range(entries)]
+    # digits never occur in the texts, so no keyword matches
+    pool = [_word(rng, string.ascii_lowercase) + _word(rng, string.digits, 1, 2)
+            for _ in range(max(sizes))]
+
+    print(f"{entries} entries x {words_per_entry} words")
+    print(f"{'keywords':>9} {'scan (s)':>10} {'automaton (s)':>14} {'build (s)':>10}")
+    for n in sizes:
+        keywords = pool[:n]
+        scan = compile_keywords(keywords, threshold=len(keywords) + 1)
+
+        t0 = time.perf_counter()
+        auto = compile_keywords(keywords, threshold=0)
+        build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        expected = [first_match(scan, t) for t in texts]
+        scan_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        got = [first_match(auto, t) for t in texts]
+        auto_time = time.perf_counter() - t0
+
+        assert got == expected
+        print(f"{n:>9} {scan_time:>10.3f} {auto_time:>14.3f} {build:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the keyword matcher.")
+    parser.add_argument("--entries", type=int, default=500)
+    parser.add_argument("--words", type=int, default=300,
+                        help="Words per entry text.")
+    parser.add_argument("--sizes", default="10,50,100,200,500,1000,2000,5000",
+                        help="Comma-separated keyword counts.")
+    args = parser.parse_args()
+    run(args.entries, args.words, [int(n) for n in args.sizes.split(",")])
@@ -1,12 +1,24 @@
 import argparse
 from html import unescape
-from datetime import datetime, timezone
-from dateutil.parser import parse
+import calendar
 import feedparser
-from feedgen.feed import FeedGenerator
 import bleach
-import re
-from prettify_domains import prettify_domains
+import hashlib
+import json
+import time
+import redis
+from concurrent.futures import ProcessPoolExecutor
+from prettify_domains import (
+    prettify_domains,
+    rules_version,
+    report_rule_stats,
+    rule_stats,
+)
+from html_rewrite import rewrite_description
+from dates import parse_timestamp, format_timestamp
+from rss_writer import rss_writer
+from item_snapshot import snapshot_path, write_snapshot
+from precompress import write_precompressed
 
 # ===== Configuration =====
 ALLOWED_TAGS = [
@@ -34,23 +46,49 @@ ALLOWED_ATTRIBUTES = {
 }
 ALLOWED_PROTOCOLS = ["http", "https"]
 
+# ===== Sanitisation cache =====
+# Redis client for caching cleaned entries
+r = redis.Redis(host="localhost", port=6379, db=0)
+# Bump when clean_entry() or prettify_domains() change their output;
+# changes to the allow-lists above or to domain_rules.txt invalidate the
+# cache automatically.
+CLEAN_CACHE_VERSION = 6
+CLEAN_CACHE_MAX_ENTRIES = 20000
+CLEAN_CACHE_LRU_KEY = "clean:lru"
+# entries handed to each pool worker at a time when cleaning in parallel
+CLEAN_BATCH_SIZE = 32
+_ALLOW_LIST_VERSION = hashlib.sha256(
+    json.dumps([ALLOWED_TAGS, ALLOWED_ATTRIBUTES, ALLOWED_PROTOCOLS], sort_keys=True)
+    .encode("utf-8")
+).hexdigest()
+# raw entry fields clean_entry() reads
+_CACHE_FIELDS = (
+    "id",
+    "timestamp",
+    "title",
+    "link",
+    "description",
+    "published",
+    "published_parsed",
+    "updated",
+    "updated_parsed",
+)
+
 
 # ===== Utility Functions =====
-def get_pub_date(entry):
-    """Determine the most reliable pubDate."""
-    if "published" in entry:
-        return entry["published"]
-    elif "published_parsed" in entry:
-        return datetime(*entry["published_parsed"][:6], tzinfo=timezone.utc).strftime(
-            "%a, %d %b %Y %H:%M:%S +0000"
-        )
-    elif "updated" in entry:
-        return entry["updated"]
-    elif "updated_parsed" in entry:
-        return datetime(*entry["updated_parsed"][:6], tzinfo=timezone.utc).strftime(
-            "%a, %d %b %Y %H:%M:%S +0000"
-        )
-    return datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")
+def get_timestamp(entry):
+    """Determine the most reliable pubDate, as a UTC epoch timestamp."""
+    if entry.get("timestamp") is not None:
+        # set once at ingest by merge_feeds
+        return entry["timestamp"]
+    for key in ("published", "updated"):
+        if entry.get(f"{key}_parsed"):
+            return calendar.timegm(entry[f"{key}_parsed"])
+        if entry.get(key):
+            timestamp = parse_timestamp(entry[key])
+            if timestamp is not None:
+                return timestamp
+    return int(time.time())
 
 
 def clean_text(text: str) -> str:
@@ -67,115 +105,158 @@ def clean_text(text: str) -> str:
     return unescape(cleaned)
 
 
-def clean_feed_entries(entries):
-    """Clean feed entries and extract valid RSS fields."""
-    cleaned = []
-    for entry in entries:
-        if not entry.get("link"):
-            continue
-        # additional item modifications based on source domain
-        entry = prettify_domains(entry)
-
-        title = entry.get("title", "")
-        description = entry.get("description", "")
-        link = entry.get("link", "")
-        pub_date = get_pub_date(entry)
-
-        title = clean_text(title)
-        # ————— auto-paragraph if no <p> or <br> tags —————
-        # look for any existing paragraph or line-break tags
-        if not re.search(r"<p\b|<br\s*/?>", description):
-            # 1) protect common abbreviations by replacing their dots with a placeholder
-            abbreviations = [
-                "Mr.",
-                "Mrs.",
-                "Ms.",
-                "Dr.",
-                "Prof.",
-                "Sr.",
-                "Jr.",
-                "St.",
-                "vs.",
-                "etc.",
-                "e.g.",
-                "i.e.",
-                "U.S.",
-                "U.K.",
-            ]
-            placeholder = "[DOT]"
-            for abbr in abbreviations:
-                description = description.replace(abbr, abbr.replace(".", placeholder))
-
-            # 2) split into sentences on ., ! or ? followed by whitespace
-            sentences = re.split(r"(?<=[.!?])\s+", description.strip())
-
-            # 3) restore the dots in the abbreviations
-            sentences = [s.replace(placeholder, ".") for s in sentences]
-
-            # 4) group every 5 sentences into one <p>…</p>
-            paras = [
-                " ".join(sentences[i : i + 5]) for i in range(0, len(sentences), 5)
-            ]
-            description = "".join(f"<p>{p}</p>" for p in paras)
-
-        description = clean_text(description)
-
-        # remove duplicate image tags from description
-        description = re.sub(
-            r'<img[^>]+src=["\'](https?://[^"\']+)["\'][^>]*>',
-            lambda m, seen=set(): (
-                seen.add(m.group(1)) or m.group(0) if m.group(1) not in seen else ""
-            ),
-            description,
-        )
-        # create an image tag
-        image = re.search(r'<img[^>]+src=["\'](.*?)["\']', description, re.IGNORECASE)
-        if image:
-            img_url = image.group(1)  # Extract the image URL
-            img_extension = img_url.split(".")[-1].lower()
-            mime_type = "image/jpeg"  # Default type
-            if img_extension == "png":
-                mime_type = "image/png"
-            elif img_extension == "gif":
-                mime_type = "image/gif"
-            elif img_extension == "jpg" or img_extension == "jpeg":
-                mime_type = "image/jpeg"
-            if img_url:
-                image = f'<media:content url="{img_url}" type="{mime_type}" />'
-        else:
-            image = ""  # If no image found, leave the content empty or handle it accordingly
-
-        entry_cleaned = {
-            "title": title,
-            "content": image,
-            "link": link,
-            "description": description,
-            "pubDate": pub_date,
-            "id": entry.get("id"),
-        }
-        cleaned.append(entry_cleaned)
+def clean_entry(entry):
+    """Sanitize one feed entry and extract valid RSS fields."""
+    # additional item modifications based on source domain
+    entry = prettify_domains(entry)
+
+    title = entry.get("title", "")
+    description = entry.get("description", "")
+    link = entry.get("link", "")
+    timestamp = get_timestamp(entry)
+
+    title = clean_text(title)
+    # sanitize, auto-paragraph, rewrite images and take the preview text in
+    # a single pass
+    description, img_url, preview = rewrite_description(
+        description, ALLOWED_TAGS, ALLOWED_ATTRIBUTES, ALLOWED_PROTOCOLS
+    )
+
+    # create an image tag
+    image = ""  # If no image found, leave the content empty
+    if img_url:
+        img_extension = img_url.split(".")[-1].lower()
+        mime_type = "image/jpeg"  # Default type
+        if img_extension == "png":
+            mime_type = "image/png"
+        elif img_extension == "gif":
+            mime_type = "image/gif"
+        elif img_extension == "jpg" or img_extension == "jpeg":
+            mime_type = "image/jpeg"
+        image = f'<media:content url="{img_url}" type="{mime_type}" />'
+
+    entry_cleaned = {
+        "title": title,
+        "content": image,
+        "link": link,
+        "description": description,
+        "preview": preview,
+        "image": img_url or "",
+        "pubDate": format_timestamp(timestamp),
+        "timestamp": timestamp,
+        "id": entry.get("id"),
+    }
+    return entry_cleaned
+
+
+def _cache_key(entry, domain_rules):
+    """Content address of an entry's raw fields plus the cleaning rules;
+    domain_rules is the rules_version() of this run."""
+    raw = json.dumps(
+        [CLEAN_CACHE_VERSION, _ALLOW_LIST_VERSION, domain_rules]
+        + [entry.get(field) for field in _CACHE_FIELDS],
+        default=str,
+    )
+    return "clean:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def clean_entries(entries, workers=1):
+    """Run clean_entry() over entries, in order.
+
+    With workers > 1 the entries are sharded across a process pool in batches
+    of CLEAN_BATCH_SIZE; results come back in input order, so the output is
+    identical to the serial path.
+    """
+    if workers <= 1 or len(entries) <= CLEAN_BATCH_SIZE:
+        return [clean_entry(entry) for entry in entries]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(clean_entry, entries, chunksize=CLEAN_BATCH_SIZE))
+
+
+def clean_feed_entries(entries, workers=1):
+    """Clean feed entries and extract valid RSS fields.
+
+    Cleaned results are cached in Redis by content address, so entries that
+    are unchanged since an earlier cycle skip prettify_domains() and bleach.
+    The cache keeps the CLEAN_CACHE_MAX_ENTRIES most recently used results.
+    Cache misses are cleaned by clean_entries() with `workers` processes.
+    """
+    # pick up edits to domain_rules.txt before hashing or forking workers
+    domain_rules = rules_version()
+    rule_stats.clear()
+    entries = [entry for entry in entries if entry.get("link")]
+    keys = [_cache_key(entry, domain_rules) for entry in entries]
+    try:
+        hits = r.mget(keys) if keys else []
+    except redis.RedisError as e:
+        print(f"Sanitisation cache unavailable, cleaning everything: {e}")
+        return clean_entries(entries, workers)
+
+    miss_positions = [i for i, hit in enumerate(hits) if hit is None]
+    fresh = clean_entries([entries[i] for i in miss_positions], workers)
+    cleaned = [json.loads(hit) if hit is not None else None for hit in hits]
+    misses = {}
+    for i, entry_cleaned in zip(miss_positions, fresh):
+        cleaned[i] = entry_cleaned
+        misses[keys[i]] = json.dumps(entry_cleaned)
+
+    try:
+        _update_clean_cache(keys, misses)
+    except redis.RedisError as e:
+        print(f"Could not update sanitisation cache: {e}")
+    print(f"Sanitisation cache: {len(entries) - len(misses)} hits, {len(misses)} misses.")
+    # only covers misses cleaned in this process (not in pool workers)
+    report_rule_stats()
     return cleaned
 
 
+def _update_clean_cache(used_keys, new_values):
+    """Store new results, mark used keys as recent and evict the least recent."""
+    if not used_keys:
+        return
+    now = time.time()
+    pipe = r.pipeline()
+    if new_values:
+        pipe.mset(new_values)
+    pipe.zadd(CLEAN_CACHE_LRU_KEY, {key: now for key in used_keys})
+    pipe.zcard(CLEAN_CACHE_LRU_KEY)
+    size = pipe.execute()[-1]
+
+    excess = size - CLEAN_CACHE_MAX_ENTRIES
+    if excess > 0:
+        stale = r.zrange(CLEAN_CACHE_LRU_KEY, 0, excess - 1)
+        pipe = r.pipeline()
+        pipe.delete(*stale)
+        pipe.zrem(CLEAN_CACHE_LRU_KEY, *stale)
+        pipe.execute()
+
+
 def validate_rss_fields(entry: dict) -> dict:
-    valid_keys = {"title", "link", "description", "pubDate", "id"}
+    valid_keys = {
+        "title",
+        "link",
+        "description",
+        "preview",
+        "image",
+        "pubDate",
+        "timestamp",
+        "id",
+    }
     return {k: entry[k] for k in entry if k in valid_keys}
 
 
-def clean_feed(input_file: str, output_file: str):
-    """Read a merged feed, sanitize entries, and write a new RSS feed."""
-    feed = feedparser.parse(input_file)
-    entries = feed.entries
+def prepare_entries(entries, workers: int = 1) -> list:
+    """Sanitize entries, sort them by date and keep only valid RSS fields."""
+    cleaned_entries = clean_feed_entries(entries, workers)
+    cleaned_entries.sort(key=lambda x: x["timestamp"])
+    return [validate_rss_fields(e) for e in cleaned_entries]
 
-    cleaned_entries = clean_feed_entries(entries)
-    cleaned_entries.sort(key=lambda x: parse(x["pubDate"]))
-    cleaned_entries = [validate_rss_fields(e) for e in cleaned_entries]
-
-    fg = FeedGenerator()
-    fg.title(feed.feed.get("title", "Cleaned Feed"))
 
+def write_clean_feed(channel, cleaned_entries, output_file: str):
+    """Write sanitized entries to the final RSS feed, its precompressed
+    siblings and its item snapshot."""
     # ————— Normalize the feed’s “link” into a string —————
-    raw_link = feed.feed.get("link", "")
+    raw_link = channel.get("link", "")
     if isinstance(raw_link, dict):
         feed_link = raw_link.get("href", "")
     elif isinstance(raw_link, list):
@@ -199,28 +280,37 @@ def clean_feed(input_file: str, output_file: str):
         # fallback default — you should set this to your site’s home URL
         feed_link = "https://example.com/"
 
-    fg.link(href=feed_link, rel="alternate")
-    fg.id(feed_link)
-    fg.description(feed.feed.get("description", ""))
-    fg.language(feed.feed.get('language', 'en'))
-    fg.generator('python-feedgen-cleaner')
-
-    for entry in cleaned_entries:
-        fe = fg.add_entry()
-        # write back our GUID
-        if entry.get('id'):
-            fe.guid(entry['id'], permalink=False)
-        fe.title(entry['title'])
-        fe.link(href=entry['link'], rel='alternate')
-        fe.pubDate(entry['pubDate'])
-        # Use cleaned HTML description from bleach
-        raw_html = entry['description']
-        # Emit the cleaned HTML inside a CDATA-wrapped <content:encoded> element
-        fe.content(raw_html, type='CDATA')
-
-    rss_bytes = fg.rss_str(pretty=True)
-    with open(output_file, 'wb') as f:
-        f.write(rss_bytes)
+    with rss_writer(
+        output_file,
+        channel.get("title", "Cleaned Feed"),
+        feed_link,
+        channel.get("description", ""),
+        channel.get("language", "en"),
+        generator="not-the-news cleaner",
+        # Caddy serves the .br/.gz siblings in place of feed.xml, so they are
+        # written before the new feed.xml is renamed into place
+        before_replace=lambda tmp_path: write_precompressed(tmp_path, output_file),
+    ) as write_item:
+        # newest first, the order feedgen's prepending add_entry() gave
+        for entry in reversed(cleaned_entries):
+            # write back our GUID and the cleaned HTML from bleach
+            write_item(
+                entry.get("id"),
+                entry["title"],
+                entry["link"],
+                entry["timestamp"],
+                entry["description"],
+                timestamp=entry["timestamp"],
+            )
+    # the API serves items from this snapshot rather than parsing feed.xml
+    write_snapshot(snapshot_path(output_file), cleaned_entries[::-1])
+
+
+def clean_feed(input_file: str, output_file: str, workers: int = 1):
+    """Read a merged feed, sanitize entries, and write a new RSS feed."""
+    feed = feedparser.parse(input_file)
+    cleaned_entries = prepare_entries(feed.entries, workers)
+    write_clean_feed(feed.feed, cleaned_entries, output_file)
     print(f"Cleaned feed saved to '{output_file}' with {len(cleaned_entries)} entries.")
 
 
@@ -232,6 +322,8 @@ if __name__ == '__main__':
                         help="Path to the merged feed XML.")
     parser.add_argument('--output', '-o', required=True,
                         help="Path to save the cleaned feed XML.")
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help="Number of processes used to sanitize entries.")
     args = parser.parse_args()
-    clean_feed(args.input, args.output)
+    clean_feed(args.input, args.output, args.workers)
 
@@ -0,0 +1,54 @@
+# Date handling shared by the pipeline stages.
+# Every entry gets one UTC epoch timestamp when it is ingested; later stages
+# sort and format from that value instead of parsing date strings again.
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+from dateutil.parser import parse
+
+
+def _to_timestamp(dt):
+    if dt.tzinfo is None:
+        # feeds without an offset are assumed to be in UTC
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+@lru_cache(maxsize=8192)
+def parse_timestamp(value):
+    """Parse a date string into a UTC epoch timestamp, or None if unparseable.
+
+    RFC-822 (RSS) and ISO-8601 (Atom) are tried first with the stdlib parsers;
+    dateutil is only the fallback. Results are memoised, as the same strings
+    come back every cycle.
+    """
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return _to_timestamp(datetime.fromisoformat(value))
+    except ValueError:
+        pass
+    try:
+        return _to_timestamp(parsedate_to_datetime(value))
+    except (TypeError, ValueError, IndexError):
+        pass
+    try:
+        return _to_timestamp(parse(value))
+    except (ValueError, OverflowError):
+        return None
+
+
+def format_timestamp(ts):
+    """Format an epoch timestamp as an RFC-822 date in UTC."""
+    return datetime.fromtimestamp(ts, timezone.utc).strftime(
+        "%a, %d %b %Y %H:%M:%S +0000"
+    )
+
+
+def iso_timestamp(ts):
+    """Format an epoch timestamp as ISO-8601 in UTC, to the second like the
+    feed's own dates."""
+    return datetime.fromtimestamp(int(ts), timezone.utc).isoformat()
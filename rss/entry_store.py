@@ -0,0 +1,144 @@
+# Persistent store of merged feed entries.
+# merge_feeds.py records every entry it has ever seen here, keyed by GUID, so a
+# cycle only adds the entries that are new, refreshes the ones that changed
+# and then reads the merged output back out of the store. Which entries each
+# feed currently lists is kept apart, in narrow listing rows that are only
+# rewritten when the feed's body changes, so a cycle in which most feeds are
+# unchanged does not touch their entries at all. The store lives next to
+# feed.xml and survives restarts of the run.py daemon.
+
+import json
+import sqlite3
+import time
+
+# entries no feed has listed for this long are deleted
+RETENTION = 30 * 24 * 3600  # seconds
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    guid       TEXT PRIMARY KEY,
+    dedup_key  TEXT NOT NULL UNIQUE,
+    feed_url   TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_seen ON entries (last_seen);
+-- the stored entry each feed's current body maps to, after de-duplication
+CREATE TABLE IF NOT EXISTS listings (
+    feed_url TEXT NOT NULL,
+    guid     TEXT NOT NULL,
+    PRIMARY KEY (feed_url, guid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS listings_guid ON listings (guid);
+"""
+
+
+def open_store(path):
+    """Open (and create if needed) the entry store at `path`."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def ingest(conn, url, feed_entries, seen_at, changed=True):
+    """Record one feed's (dedup key, entry) pairs; returns how many were new.
+
+    Entries this feed stored earlier are refreshed with its current data and
+    dedup key when either differs. An entry whose GUID or dedup key is stored
+    from another feed is a duplicate of it: the entry stored first is kept,
+    as the in-memory merge keeps the first one seen.
+
+    When `changed` is false the feed's body is the one already ingested, and
+    its listing is left as it is. The caller commits.
+    """
+    if not changed and conn.execute(
+        "SELECT 1 FROM listings WHERE feed_url = ? LIMIT 1", (url,)
+    ).fetchone():
+        return 0
+
+    added = 0
+    listed = []
+    for key, entry in feed_entries:
+        guid = entry["id"]
+        row = conn.execute(
+            "SELECT feed_url, dedup_key, data FROM entries WHERE guid = ?", (guid,)
+        ).fetchone()
+        if row is not None and row[0] != url:
+            listed.append(guid)  # stored from another feed first
+            continue
+        if row is None or row[1] != key:
+            owner = conn.execute(
+                "SELECT guid FROM entries WHERE dedup_key = ?", (key,)
+            ).fetchone()
+            if owner is not None:
+                listed.append(owner[0])
+                continue
+        data = json.dumps(entry)
+        if row is None:
+            conn.execute(
+                "INSERT INTO entries"
+                " (guid, dedup_key, feed_url, data, first_seen, last_seen)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (guid, key, url, data, seen_at, seen_at),
+            )
+            added += 1
+        elif row[1] != key or row[2] != data:
+            # the row's rowid, and so its place in current_entries(), is kept
+            conn.execute(
+                "UPDATE entries SET data = ?, dedup_key = ? WHERE guid = ?",
+                (data, key, guid),
+            )
+        listed.append(guid)
+
+    _drop_listing(conn, url, seen_at)
+    conn.executemany(
+        "INSERT OR IGNORE INTO listings (feed_url, guid) VALUES (?, ?)",
+        ((url, guid) for guid in listed),
+    )
+    return added
+
+
+def _drop_listing(conn, url, seen_at):
+    """Delete a feed's listing, stamping its entries as last seen at seen_at."""
+    conn.execute(
+        "UPDATE entries SET last_seen = ?"
+        " WHERE guid IN (SELECT guid FROM listings WHERE feed_url = ?)",
+        (seen_at, url),
+    )
+    conn.execute("DELETE FROM listings WHERE feed_url = ?", (url,))
+
+
+def retire_feeds(conn, urls, seen_at):
+    """Drop the listings of every feed not in `urls`, e.g. one removed from
+    feeds.txt or without entries this cycle. The caller commits."""
+    urls = set(urls)
+    listed_feeds = [
+        url for (url,) in conn.execute("SELECT DISTINCT feed_url FROM listings")
+    ]
+    for url in listed_feeds:
+        if url not in urls:
+            _drop_listing(conn, url, seen_at)
+
+
+def current_entries(conn):
+    """Return the stored entries some feed currently lists, oldest first."""
+    rows = conn.execute(
+        "SELECT data FROM entries"
+        " WHERE guid IN (SELECT guid FROM listings) ORDER BY rowid"
+    )
+    return [json.loads(data) for (data,) in rows]
+
+
+def prune(conn, now=None):
+    """Delete entries no feed has listed for RETENTION seconds."""
+    now = time.time() if now is None else now
+    deleted = conn.execute(
+        "DELETE FROM entries WHERE last_seen < ?"
+        " AND guid NOT IN (SELECT guid FROM listings)",
+        (now - RETENTION,),
+    ).rowcount
+    conn.commit()
+    return deleted
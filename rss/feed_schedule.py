@@ -0,0 +1,124 @@
+# Per-feed refresh schedule for merge_feeds.py.
+# Instead of fetching every feed on every cycle, each feed gets its own due
+# time. It is derived from how often the feed publishes (the spacing of its
+# recent entries), what the feed asks for itself (<ttl>, sy:updatePeriod) and
+# whether recent fetches found it unchanged, so a busy subreddit stays at
+# MIN_REFRESH while a blog that posts weekly is fetched a few times a day.
+# The schedule lives in Redis next to the cached bodies it decides about.
+
+# bounds of the interval between two fetches of one feed
+MIN_REFRESH = 5 * 60  # seconds
+MAX_REFRESH = 6 * 3600  # seconds
+# each fetch that finds the feed unchanged stretches its interval this much
+UNCHANGED_BACKOFF = 1.5
+# newest entries whose spacing estimates the publishing rate
+RECENT_ENTRIES = 10
+# a feed removed from feeds.txt loses its schedule with its cached body
+SCHEDULE_TTL = 7 * 24 * 3600  # seconds
+
+# sy:updatePeriod → seconds
+_SY_PERIODS = {
+    "hourly": 3600,
+    "daily": 24 * 3600,
+    "weekly": 7 * 24 * 3600,
+    "monthly": 30 * 24 * 3600,
+    "yearly": 365 * 24 * 3600,
+}
+
+
+def _key(url):
+    return f"rss:schedule:{url}"
+
+
+def publisher_interval(feed):
+    """Return the refresh interval a parsed feed header asks for, in seconds,
+    or None. <ttl> is in minutes; sy:updatePeriod / sy:updateFrequency say
+    how many updates to expect per period. The longer of the two wins.
+    """
+    hints = []
+    try:
+        hints.append(float(feed.get("ttl")) * 60)
+    except (TypeError, ValueError):
+        pass
+    period = _SY_PERIODS.get(str(feed.get("sy_updateperiod", "")).strip().lower())
+    if period:
+        try:
+            frequency = max(1.0, float(feed.get("sy_updatefrequency") or 1))
+        except ValueError:
+            frequency = 1.0
+        hints.append(period / frequency)
+    return max(hints) if hints else None
+
+
+def observed_interval(entries, now):
+    """Estimate the average time between posts from the newest entries.
+
+    The window runs up to `now` rather than to the newest post, so a feed
+    that went quiet after a burst is not polled as if it were still busy.
+    """
+    timestamps = sorted((entry["timestamp"] for _, entry in entries), reverse=True)
+    recent = timestamps[:RECENT_ENTRIES]
+    if not recent:
+        return None
+    return max(0.0, now - recent[-1]) / len(recent)
+
+
+def next_interval(previous, changed, observed, hint):
+    """Pick the interval until the next fetch of a feed."""
+    if changed or previous is None:
+        interval = observed if observed is not None else MIN_REFRESH
+    else:
+        interval = previous * UNCHANGED_BACKOFF
+    if hint is not None:
+        interval = max(interval, hint)
+    return min(MAX_REFRESH, max(MIN_REFRESH, interval))
+
+
+def due_feeds(r, urls, now):
+    """Return the urls whose next fetch is due at `now`, keeping their order.
+
+    Feeds without a schedule (new, or expired) are always due.
+    """
+    pipe = r.pipeline()
+    for url in urls:
+        pipe.hget(_key(url), "due")
+    return [
+        url
+        for url, due in zip(urls, pipe.execute())
+        if due is None or float(due) <= now
+    ]
+
+
+def record_fetch(r, url, digest, entries, hint, now):
+    """Schedule the next fetch of a feed that was just fetched successfully.
+
+    `digest` identifies the body; returns (changed, replaced): changed is
+    True if it differs from the one recorded by the previous fetch, and
+    replaced is that previous digest when it was superseded, else None.
+    """
+    key = _key(url)
+    previous, previous_digest = r.hmget(key, "interval", "digest")
+    if previous_digest is not None:
+        previous_digest = previous_digest.decode()
+    changed = previous_digest != digest
+    interval = next_interval(
+        float(previous) if previous is not None else None,
+        changed,
+        observed_interval(entries, now),
+        hint,
+    )
+    pipe = r.pipeline()
+    pipe.hset(
+        key, mapping={"due": now + interval, "interval": interval, "digest": digest}
+    )
+    pipe.expire(key, SCHEDULE_TTL)
+    pipe.execute()
+    return changed, previous_digest if changed else None
+
+
+def record_failure(r, url, now):
+    """Retry a feed whose fetch failed after MIN_REFRESH, keeping its interval."""
+    pipe = r.pipeline()
+    pipe.hset(_key(url), "due", now + MIN_REFRESH)
+    pipe.expire(_key(url), SCHEDULE_TTL)
+    pipe.execute()
@@ -1,28 +1,12 @@
 import feedparser
-import xml.etree.ElementTree as ET
 import argparse
-import xml.dom.minidom
+import calendar
+import os
+from filter_rules import compile_rules, evaluate
+from rss_writer import rss_writer
 
-# Set up argument parser
-parser = argparse.ArgumentParser(description="Filter an RSS feed based on keywords.")
-parser.add_argument("--input", required=True, help="Path to the input RSS file")
-parser.add_argument(
-    "--output", required=True, help="Path to save the filtered RSS file"
-)
-parser.add_argument("--keywords", required=True, help="Path to the keywords file")
-
-# Parse arguments
-args = parser.parse_args()
-
-# Assign parsed arguments to variables
-input_rss_file = args.input
-output_rss_file = args.output
-keywords_file = args.keywords
-
-# Print the parsed arguments (optional, for testing purposes)
-print(f"Input RSS file: {input_rss_file}")
-print(f"Output RSS file: {output_rss_file}")
-print(f"Keywords file: {keywords_file}")
+# compiled rules keyed by keywords file path → (mtime, rules)
+_rules_cache = {}
 
 
 def load_filter_keywords(file_path):
@@ -37,23 +21,102 @@ def load_filter_keywords(file_path):
         exit(1)
 
 
-def save_pretty_xml(output_file, tree):
-    """Save the XML tree to the file with pretty printing."""
-    # Convert the tree to a string
-    xml_str = ET.tostring(tree.getroot(), encoding="utf-8", method="xml")
-
-    # Use minidom to format the string with indentation
-    pretty_xml = xml.dom.minidom.parseString(xml_str).toprettyxml(indent="  ")
+def load_filter_rules(file_path):
+    """Load and compile the keyword rules file, reusing the last compile while
+    the file's mtime is unchanged."""
+    try:
+        mtime = os.stat(file_path).st_mtime_ns
+    except FileNotFoundError:
+        print(f"Error: Keywords file {file_path} not found.")
+        exit(1)
+    cached = _rules_cache.get(file_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    rules = compile_rules(load_filter_keywords(file_path))
+    _rules_cache[file_path] = (mtime, rules)
+    return rules
+
+
+def normalise_entry(entry):
+    """Reduce a feedparser entry to the plain dict shape used between stages."""
+    # ==== BUILD RAW HTML FOR DESCRIPTION (prefer full content over summary) ====
+    raw_html = ""
+    if entry.get("content"):
+        # Use the full content block if available
+        raw_html = entry.content[0].value
+    elif entry.get("summary"):
+        # Fallback to summary
+        raw_html = entry.summary
+    elif entry.get("description"):
+        # Some feeds use description directly
+        raw_html = entry.description
+    # ========================================================================
+    normalised = {
+        "id": entry.get("id", entry.get("link", "")),
+        "title": entry.get("title", ""),
+        "link": entry.get("link", ""),
+        "published": entry.get("published", ""),
+        "description": raw_html,
+    }
+    # feedparser has already parsed the date into a UTC struct_time
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    if parsed:
+        normalised["timestamp"] = calendar.timegm(parsed)
+    if "author" in entry:
+        normalised["author"] = entry["author"]
+    if entry.get("tags"):
+        normalised["tags"] = [tag.get("term", "") for tag in entry["tags"]]
+    return normalised
+
+
+def filter_entries(entries, rules):
+    """Return the entries that match no block rule, or match a whitelist set."""
+    filtered_entries = []
+    for entry in entries:
+        matched, promoted = evaluate(rules, entry)
 
-    # Write the pretty-printed XML to the file
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(pretty_xml)
+        if matched is None:
+            filtered_entries.append(entry)
+        elif promoted is not None:
+            filtered_entries.append(entry)
+            print(
+                f"Keeping whitelisted entry ({promoted}) despite keyword match: "
+                f"{matched}: {entry.get('title', 'No title')}"
+            )
+        else:
+            print(
+                f"Excluding entry with keyword match: "
+                f"{matched}: {entry.get('title', 'No title')}"
+            )
+    print(f"Filtered {len(filtered_entries)} entries out of {len(entries)}.")
+    return filtered_entries
+
+
+def write_filtered_feed(channel, entries, output_file):
+    """Write filtered entries to an RSS file (the filtered_feed.xml format)."""
+    with rss_writer(
+        output_file,
+        channel.get("title", ""),
+        channel.get("link", ""),
+        channel.get("description", ""),
+        channel.get("language", "en"),
+    ) as write_item:
+        for entry in entries:
+            write_item(
+                entry.get("id", ""),
+                entry.get("title", ""),
+                entry.get("link", ""),
+                entry.get("timestamp") or entry.get("published", ""),
+                entry.get("description", ""),
+                author=entry.get("author"),
+                categories=entry.get("tags", []),
+            )
 
 
 def filter_rss_entries(input_file, output_file, keywords_file):
     """Filter RSS feed entries based on keywords."""
     # Load filter keywords
-    keywords = load_filter_keywords(keywords_file)
+    rules = load_filter_rules(keywords_file)
 
     # Parse the RSS feed
     print(f"Parsing RSS feed from {input_file}...")
@@ -62,82 +125,35 @@ def filter_rss_entries(input_file, output_file, keywords_file):
         print(f"Warning: No entries found in the RSS feed.")
         exit(1)
 
-    # Filter entries based on keywords
-    filtered_entries = []
-    for entry in feed.entries:
-        # Combine all fields of the entry into a single text for keyword matching
-        entry_text = " ".join(
-            [str(value).lower() for key, value in entry.items() if value]
-        )
-        matched = next((kw for kw in keywords if kw in entry_text), None)
+    entries = [normalise_entry(entry) for entry in feed.entries]
+    filtered_entries = filter_entries(entries, rules)
 
-        if matched is None:
-            filtered_entries.append(entry)
-        else:
-            print(
-                f"Excluding entry with keyword match: "
-                f"{matched}: {getattr(entry, 'title', 'No title')}"
-            )
-    print(f"Filtered {len(filtered_entries)} entries out of {len(feed.entries)}.")
-
-    # Create a new XML tree for the filtered feed, declaring media namespace
-    filtered_root = ET.Element(
-        "rss", attrib={"version": "2.0", "xmlns:media": "http://search.yahoo.com/mrss/"}
-    )
-    channel_elem = ET.SubElement(filtered_root, "channel")
-
-    # Add metadata from the original feed
-    for key, value in feed.feed.items():
-        ET.SubElement(channel_elem, key).text = str(value)
-
-    # Add filtered entries to the feed
-    for entry in filtered_entries:
-        item = ET.SubElement(channel_elem, "item")  # define 'item' here
-        ET.SubElement(item, "title").text = entry.get("title", "")
-        for linkinfo in entry.links:
-            ET.SubElement(
-                item,
-                "link",
-                attrib={
-                    "href": linkinfo["href"],
-                    "rel": linkinfo.get("rel", ""),
-                    "type": linkinfo.get("type", ""),
-                },
-            )
-        # ==== BUILD RAW HTML FOR DESCRIPTION (prefer full content over summary) ====
-        raw_html = ""
-        if entry.get("content"):
-            # Use the full content block if available
-            raw_html = entry.content[0].value
-        elif entry.get("summary"):
-            # Fallback to summary
-            raw_html = entry.summary
-        elif entry.get("description"):
-            # Some feeds use description directly
-            raw_html = entry.description
-        ET.SubElement(item, "description").text = raw_html
-        # ========================================================================
-
-        ET.SubElement(item, "pubDate").text = entry.get("published", "")
-        ET.SubElement(item, "guid").text = entry.get("id", entry.link)
-
-        if "author" in entry:
-            ET.SubElement(item, "author").text = entry["author"]
-
-        for tag in entry.get("tags", []):
-            ET.SubElement(item, "category").text = tag.get("term", "")
-
-    # Create the XML tree for the filtered feed
-    filtered_tree = ET.ElementTree(filtered_root)
-
-    # Save the filtered feed to a new RSS file using the pretty print function
     try:
-        save_pretty_xml(output_file, filtered_tree)
+        write_filtered_feed(feed.feed, filtered_entries, output_file)
         print(f"Filtered RSS feed saved to {output_file}.")
     except Exception as e:
         print(f"Error saving filtered feed: {e}")
         exit(1)
 
 
-# Run the filtering process
-filter_rss_entries(input_rss_file, output_rss_file, keywords_file)
+if __name__ == "__main__":
+    # Set up argument parser
+    parser = argparse.ArgumentParser(
+        description="Filter an RSS feed based on keywords."
+    )
+    parser.add_argument("--input", required=True, help="Path to the input RSS file")
+    parser.add_argument(
+        "--output", required=True, help="Path to save the filtered RSS file"
+    )
+    parser.add_argument("--keywords", required=True, help="Path to the keywords file")
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    # Print the parsed arguments (optional, for testing purposes)
+    print(f"Input RSS file: {args.input}")
+    print(f"Output RSS file: {args.output}")
+    print(f"Keywords file: {args.keywords}")
+
+    # Run the filtering process
+    filter_rss_entries(args.input, args.output, args.keywords)
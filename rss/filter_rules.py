@@ -0,0 +1,108 @@
+# Keyword rules for filter_feed.py, parsed from filter_keywords.txt.
+#
+# One rule per line, matched case-insensitively:
+#   trump                  block entries containing "trump" in any default field
+#   title: football        block only when "football" is in the title
+#   domain: example.com    block entries linking to that host
+#   +breaking, war         whitelist set: an entry containing *all* of these
+#                          terms is kept even if a block rule matched it
+#   +title: breaking, war  terms of a whitelist set may be field-scoped too
+# Lines starting with "#" are comments.
+#
+# Block rules are compiled per field into keyword matchers, so an entry only
+# has the fields some rule actually needs extracted and scanned.
+
+from urllib.parse import urlparse
+
+from keyword_matcher import compile_keywords, first_match
+
+FIELDS = ("title", "description", "author", "tags", "link", "domain")
+# fields an unscoped rule looks at ("domain" is covered by "link")
+DEFAULT_FIELDS = ("title", "description", "author", "tags", "link")
+
+
+def _parse_term(text):
+    """Split "field: keyword" into (field, keyword); field is None if unscoped."""
+    field, sep, keyword = text.partition(":")
+    field = field.strip()
+    if sep and field in FIELDS and keyword.strip():
+        return field, keyword.strip()
+    return None, text.strip()
+
+
+def compile_rules(lines):
+    """Compile rule lines into (block matchers, whitelist sets, rule labels).
+
+    Block matchers map field → (matcher, keyword → rule index); the lowest
+    rule index across fields is reported, so the "first matched keyword" is
+    still the first matching line of the file.
+    """
+    per_field = {field: [] for field in FIELDS}
+    whitelist = []
+    labels = []
+    for line in lines:
+        line = line.strip().lower()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("+"):
+            terms = [_parse_term(t) for t in line[1:].split(",") if t.strip()]
+            if terms:
+                whitelist.append((line, terms))
+            continue
+        field, keyword = _parse_term(line)
+        idx = len(labels)
+        labels.append(line)
+        for f in (field,) if field else DEFAULT_FIELDS:
+            per_field[f].append((idx, keyword))
+
+    block = {}
+    for field, rules in per_field.items():
+        if not rules:
+            continue
+        index = {}
+        for idx, keyword in rules:
+            index.setdefault(keyword, idx)
+        block[field] = (compile_keywords([kw for _, kw in rules]), index)
+    return block, whitelist, labels
+
+
+def _field_text(entry, field):
+    """Return the lowercased text of one entry field."""
+    if field == "tags":
+        value = " ".join(entry.get("tags", []))
+    elif field == "domain":
+        try:
+            value = urlparse(entry.get("link", "")).hostname or ""
+        except ValueError:
+            value = ""
+    else:
+        value = entry.get(field) or ""
+    return str(value).lower()
+
+
+def evaluate(rules, entry):
+    """Return (blocking rule or None, whitelist set or None) for an entry."""
+    block, whitelist, labels = rules
+    texts = {}
+
+    def text(field):
+        if field not in texts:
+            texts[field] = _field_text(entry, field)
+        return texts[field]
+
+    best = None
+    for field, (matcher, index) in block.items():
+        keyword = first_match(matcher, text(field))
+        if keyword is not None and (best is None or index[keyword] < best):
+            best = index[keyword]
+    blocked = labels[best] if best is not None else None
+
+    promoted = None
+    for label, terms in whitelist:
+        if all(
+            any(kw in text(f) for f in ((field,) if field else DEFAULT_FIELDS))
+            for field, kw in terms
+        ):
+            promoted = label
+            break
+    return blocked, promoted
@@ -0,0 +1,168 @@
+# Single-pass HTML rewrite for entry descriptions.
+# Sanitising, image rewriting (lazy loading, anchor wrapping, duplicate
+# removal), picking the first image for <media:content> and collecting the
+# text for the item preview all happen in one walk over bleach's html5lib
+# token stream, instead of a regex pass before bleach and two more over its
+# output.
+
+import re
+from functools import partial
+from html import unescape
+
+from bleach import html5lib_shim
+from bleach.sanitizer import Cleaner
+
+_PARAGRAPH_TAG = re.compile(r"<p\b|<br\s*/?>")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_ABBREVIATIONS = re.compile(
+    "|".join(
+        re.escape(abbr)
+        for abbr in (
+            "Mr.",
+            "Mrs.",
+            "Ms.",
+            "Dr.",
+            "Prof.",
+            "Sr.",
+            "Jr.",
+            "St.",
+            "vs.",
+            "etc.",
+            "e.g.",
+            "i.e.",
+            "U.S.",
+            "U.K.",
+        )
+    )
+)
+_PLACEHOLDER = "[DOT]"
+# only absolute image URLs are de-duplicated
+_REMOTE_URL = re.compile(r"https?://")
+# characters of plain text kept as the item preview
+PREVIEW_LENGTH = 200
+# elements whose boundaries separate words in the preview
+_BLOCK_TAGS = frozenset(
+    ("p", "br", "div", "li", "ul", "h1", "h2", "h3", "h4", "h5", "h6", "img")
+)
+
+
+def auto_paragraph(text):
+    """Wrap plain text into <p>s of five sentences, unless it has <p>/<br> tags."""
+    if _PARAGRAPH_TAG.search(text):
+        return text
+    # protect common abbreviations by replacing their dots with a placeholder
+    text = _ABBREVIATIONS.sub(lambda m: m.group(0).replace(".", _PLACEHOLDER), text)
+    # split into sentences on ., ! or ? followed by whitespace, restoring the dots
+    sentences = [
+        s.replace(_PLACEHOLDER, ".") for s in _SENTENCE_END.split(text.strip())
+    ]
+    paras = [" ".join(sentences[i : i + 5]) for i in range(0, len(sentences), 5)]
+    return "".join(f"<p>{p}</p>" for p in paras)
+
+
+def text_preview(text, length=PREVIEW_LENGTH):
+    """Collapse whitespace and cut text to about `length` characters,
+    breaking at a word boundary."""
+    text = " ".join(text.split())
+    if len(text) <= length:
+        return text
+    cut = text[: length + 1]
+    cut = cut.rsplit(" ", 1)[0] if " " in cut else text[:length]
+    return cut.rstrip(" ,;:-") + "…"
+
+
+def _is_source_url(token):
+    """Whether a span start tag is a hidden source-url span."""
+    classes = token["data"].get((None, "class"), "")
+    return "source-url" in classes.split()
+
+
+class ImageRewriteFilter(html5lib_shim.Filter):
+    """Lazy-load images, wrap them in a link to themselves and drop repeats.
+
+    The src of the first image is appended to `images`, and the text of the
+    first PREVIEW_LENGTH or so characters to `text`. Text inside the hidden
+    source-url spans added by the domain rules is left out of the preview.
+    """
+
+    def __init__(self, source, images, text):
+        super().__init__(source)
+        self.images = images
+        self.text = text
+
+    def __iter__(self):
+        seen = set()
+        # stop collecting once there is enough for the preview, spaces included
+        text_budget = 2 * PREVIEW_LENGTH
+        # span nesting depth inside a source-url span, 0 when outside one
+        hidden_depth = 0
+        for token in super().__iter__():
+            kind = token["type"]
+            if kind == "StartTag" and token["name"] == "span":
+                if hidden_depth:
+                    hidden_depth += 1
+                elif _is_source_url(token):
+                    hidden_depth = 1
+            elif kind == "EndTag" and token["name"] == "span" and hidden_depth:
+                hidden_depth -= 1
+            elif text_budget > 0 and not hidden_depth:
+                if kind in ("Characters", "SpaceCharacters"):
+                    self.text.append(token["data"])
+                    text_budget -= len(token["data"])
+                elif kind == "Entity":
+                    # bleach keeps entities as their own tokens
+                    char = unescape("&%s;" % token["name"])
+                    self.text.append(char)
+                    text_budget -= len(char)
+                elif token.get("name") in _BLOCK_TAGS:
+                    self.text.append(" ")
+            if kind not in ("StartTag", "EmptyTag") or token["name"] != "img":
+                yield token
+                continue
+            src = token["data"].get((None, "src"))
+            if not src:
+                yield token
+                continue
+
+            namespace = token.get("namespace")
+            yield {
+                "type": "StartTag",
+                "name": "a",
+                "namespace": namespace,
+                "data": {(None, "href"): src},
+            }
+            # bleach leaves entities in attribute values; compare the real URL
+            url = unescape(src)
+            if not (url in seen and _REMOTE_URL.match(url)):
+                seen.add(url)
+                if not self.images:
+                    self.images.append(url)
+                attrs = {(None, "loading"): "lazy"}
+                attrs.update(
+                    (key, value)
+                    for key, value in token["data"].items()
+                    if key != (None, "loading")
+                )
+                yield dict(token, data=attrs)
+            yield {"type": "EndTag", "name": "a", "namespace": namespace, "data": {}}
+
+
+def rewrite_description(text, tags, attributes, protocols):
+    """Sanitize a description and rewrite its images in one pass.
+
+    Returns (html, src of the first image or None, plain-text preview).
+    """
+    text = auto_paragraph(text)
+    if not text:
+        return "", None, ""
+    images = []
+    preview = []
+    cleaner = Cleaner(
+        tags=tags,
+        attributes=attributes,
+        protocols=protocols,
+        strip=True,
+        filters=[partial(ImageRewriteFilter, images=images, text=preview)],
+    )
+    html = unescape(cleaner.clean(text))
+    return html, (images[0] if images else None), text_preview("".join(preview))
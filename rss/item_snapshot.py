@@ -0,0 +1,167 @@
+# Item snapshot written next to feed.xml at the end of the clean stage.
+# It holds exactly what the API serves (guid, title, link, ISO pubDate,
+# description, plus the text preview and first image of summary payloads)
+# in an SQLite file keyed by GUID, so the API can answer /guids
+# and /items with index lookups instead of parsing RSS. The file is replaced
+# atomically and is read-only for its consumers, so every gunicorn worker
+# shares it through the page cache.
+#
+# Every snapshot also gets the next feed generation number and carries the
+# GUIDs added and removed by each of the last MAX_GENERATIONS generations, so
+# clients can ask the API for just the changes since the generation they have.
+#
+# Response bodies that do not depend on the request, like the full /guids
+# list, are stored ready-made in the payloads table, plain and precompressed.
+
+import os
+import sqlite3
+import tempfile
+import json
+import time
+
+from dates import iso_timestamp
+from precompress import compress
+
+# stored as PRAGMA user_version; bump when the schema changes so readers
+# that expect another layout fall back to feed.xml
+SNAPSHOT_VERSION = 5
+SNAPSHOT_NAME = "items.db"
+# generations of added/removed GUIDs kept (a day of 5-minute cycles)
+MAX_GENERATIONS = 288
+
+_SCHEMA = """
+CREATE TABLE items (
+    guid        TEXT PRIMARY KEY,
+    position    INTEGER NOT NULL,
+    title       TEXT,
+    link        TEXT,
+    pub_date    TEXT,
+    timestamp   INTEGER,
+    description TEXT,
+    preview     TEXT,
+    image       TEXT
+) WITHOUT ROWID;
+CREATE INDEX items_position ON items (position);
+-- the API pages through items newest first
+CREATE INDEX items_pub_date ON items (pub_date DESC, guid);
+CREATE TABLE meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE changes (
+    generation INTEGER NOT NULL,
+    guid       TEXT NOT NULL,
+    added      INTEGER NOT NULL
+);
+CREATE INDEX changes_generation ON changes (generation);
+CREATE TABLE payloads (
+    name     TEXT NOT NULL,
+    encoding TEXT NOT NULL,
+    body     BLOB NOT NULL,
+    PRIMARY KEY (name, encoding)
+) WITHOUT ROWID;
+"""
+
+
+def _read_previous(path):
+    """Return (generation, delta base, guid set, change rows) of the snapshot
+    at path, or None if there is no readable snapshot of this version."""
+    if not os.path.exists(path):
+        return None
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SNAPSHOT_VERSION:
+            return None
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        guids = {g for (g,) in conn.execute("SELECT guid FROM items")}
+        changes = conn.execute(
+            "SELECT generation, guid, added FROM changes ORDER BY rowid"
+        ).fetchall()
+        return meta["generation"], meta["base"], guids, changes
+    except (sqlite3.Error, KeyError):
+        return None
+    finally:
+        conn.close()
+
+
+def snapshot_path(feed_file):
+    """Path of the snapshot that accompanies a feed file."""
+    return os.path.join(os.path.dirname(os.path.abspath(feed_file)), SNAPSHOT_NAME)
+
+
+def write_snapshot(path, entries):
+    """Write cleaned entries (in feed order) to a new snapshot at path.
+
+    Returns the new generation number.
+    """
+    rows = [
+        (
+            entry.get("id") or entry["link"],
+            position,
+            entry["title"],
+            entry["link"],
+            iso_timestamp(entry["timestamp"]),
+            int(entry["timestamp"]),
+            entry["description"],
+            entry.get("preview", ""),
+            entry.get("image", ""),
+        )
+        for position, entry in enumerate(entries)
+    ]
+    guids = {row[0] for row in rows}
+    # the /guids body: GUIDs in feed order, first occurrence wins like the
+    # INSERT OR IGNORE below
+    guids_body = json.dumps(
+        list(dict.fromkeys(row[0] for row in rows)), separators=(",", ":")
+    ).encode("utf-8")
+    payloads = [("guids", "identity", guids_body)]
+    payloads += [
+        ("guids", encoding, body) for encoding, body in compress(guids_body).items()
+    ]
+
+    previous = _read_previous(path)
+    if previous is None:
+        # no history: clients can only get deltas from this generation on.
+        # Starting from the clock keeps generations increasing even when the
+        # snapshot is lost or its format changes.
+        generation = int(time.time())
+        base, changes = generation, []
+    else:
+        prev_generation, base, prev_guids, changes = previous
+        generation = prev_generation + 1
+        changes += [(generation, g, 1) for g in guids - prev_guids]
+        changes += [(generation, g, 0) for g in prev_guids - guids]
+        # a delta from `base` needs the changes of every later generation
+        base = max(base, generation - MAX_GENERATIONS)
+        changes = [c for c in changes if c[0] > base]
+
+    out_dir = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=".", suffix=".db.tmp")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript(_SCHEMA)
+            conn.executemany(
+                "INSERT OR IGNORE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            conn.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [("generation", generation), ("base", base)],
+            )
+            conn.executemany("INSERT INTO changes VALUES (?, ?, ?)", changes)
+            conn.executemany("INSERT INTO payloads VALUES (?, ?, ?)", payloads)
+            conn.execute(f"PRAGMA user_version = {SNAPSHOT_VERSION}")
+            conn.commit()
+        finally:
+            conn.close()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return generation
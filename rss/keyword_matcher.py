@@ -0,0 +1,72 @@
+# Multi-keyword matcher for filter_feed.py.
+# A keyword list is compiled once into an Aho-Corasick automaton, so matching
+# an entry costs one pass over its text no matter how many keywords there are.
+# The result is the same as scanning the list in order: the earliest keyword
+# in the list that occurs anywhere in the text.
+
+from collections import deque
+
+# Below this many keywords, str.__contains__ per keyword (which runs in C) is
+# faster than walking the automaton in Python; see bench_keyword_matcher.py.
+AUTOMATON_THRESHOLD = 300
+
+_NO_MATCH = float("inf")
+
+
+def _build_automaton(keywords):
+    """Build the goto/fail tables; first[node] is the lowest keyword index
+    ending at that node or at any of its fail-link suffixes."""
+    goto = [{}]
+    first = [_NO_MATCH]
+    for idx, kw in enumerate(keywords):
+        node = 0
+        for ch in kw:
+            nxt = goto[node].get(ch)
+            if nxt is None:
+                nxt = len(goto)
+                goto[node][ch] = nxt
+                goto.append({})
+                first.append(_NO_MATCH)
+            node = nxt
+        first[node] = min(first[node], idx)
+
+    # breadth-first so every fail target is finished before it is used
+    fail = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for ch, child in goto[node].items():
+            f = fail[node]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[child] = goto[f].get(ch, 0)
+            first[child] = min(first[child], first[fail[child]])
+            queue.append(child)
+    return goto, fail, first
+
+
+def compile_keywords(keywords, threshold=AUTOMATON_THRESHOLD):
+    """Compile a keyword list into a matcher for first_match()."""
+    keywords = list(keywords)
+    automaton = _build_automaton(keywords) if len(keywords) >= threshold else None
+    return keywords, automaton
+
+
+def first_match(matcher, text):
+    """Return the first keyword (in list order) contained in text, or None."""
+    keywords, automaton = matcher
+    if automaton is None:
+        return next((kw for kw in keywords if kw in text), None)
+
+    goto, fail, first = automaton
+    node = 0
+    best = _NO_MATCH
+    for ch in text:
+        while node and ch not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(ch, 0)
+        if first[node] < best:
+            best = first[node]
+            if best == 0:
+                break
+    return None if best == _NO_MATCH else keywords[best]
@@ -1,18 +1,31 @@
+import sys
 import time
 from urllib.parse import urlparse
 import feedparser
 import threading
-from feedgen.feed import FeedGenerator
-from datetime import datetime, timezone
-from dateutil.parser import parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dates import parse_timestamp, format_timestamp
 import argparse
 import requests
-import pprint
 import hashlib
+import json
+import zlib
 import redis
+import entry_store
+import feed_schedule
+from rss_writer import rss_writer
 
 # ─── Redis client for caching raw feed bytes ─────────────────────────────────
 r = redis.Redis(host="localhost", port=6379, db=0)
+# Cached bodies are revalidated with a conditional GET on every fetch, so the
+# TTL only garbage-collects feeds that were removed from feeds.txt.
+CACHE_TTL = 7 * 24 * 3600  # seconds
+# Part of every parsed-entries cache key; bump it whenever normalise_entries()
+# changes its output so stale entry lists are ignored (and expire via the TTL).
+NORMALISE_VERSION = 4
+# merge_feeds.py --scheduled exits with this when no feed changed
+UNCHANGED_EXIT = 3
 
 # ─── Global backoff & rate-limit settings ─────────────────────────────────────
 
@@ -34,18 +47,19 @@ def _consume_token():
     """Block until a token is available from the bucket, then consume one."""
     global _tokens, _last_refill
     while True:
-        now = time.monotonic()
-        elapsed = now - _last_refill
         with _bucket_lock:
-            # refill
+            # refill (read the clock under the lock so concurrent fetch
+            # threads can't double-count the same elapsed interval)
+            now = time.monotonic()
+            elapsed = now - _last_refill
             _tokens = min(BUCKET_CAPACITY, _tokens + elapsed * REFILL_RATE)
             _last_refill = now
             if _tokens >= 1:
                 _tokens -= 1
                 return
             # else: not enough tokens, will sleep outside lock
-        # compute how long until at least one token
-        to_wait = (1 - _tokens) / REFILL_RATE
+            # compute how long until at least one token
+            to_wait = (1 - _tokens) / REFILL_RATE
         time.sleep(to_wait)
 
 
@@ -60,6 +74,10 @@ domain_last_request = {}
 # minimum delay between requests to the same domain
 DOMAIN_DELAY = 1.0  # seconds
 
+# Number of domains fetched in parallel. Feeds on the same domain are always
+# fetched one after another by a single worker, so DOMAIN_DELAY still holds.
+FETCH_WORKERS = 8
+
 # Create a single Session with your custom User-Agent
 session = requests.Session()
 session.headers.update({"User-Agent": "not-the-news/1.0 (by /u/not-the-news-app)"})
@@ -74,16 +92,45 @@ def extract_domain(url, cache={}):
     return cache[url]
 
 
+def _store_response(key, validators_key, resp):
+    """Cache a feed body and its ETag / Last-Modified validators in Redis."""
+    validators = {}
+    if resp.headers.get("ETag"):
+        validators["etag"] = resp.headers["ETag"]
+    if resp.headers.get("Last-Modified"):
+        validators["last_modified"] = resp.headers["Last-Modified"]
+
+    pipe = r.pipeline()
+    pipe.set(key, resp.content, ex=CACHE_TTL)
+    pipe.delete(validators_key)
+    if validators:
+        pipe.hset(validators_key, mapping=validators)
+        pipe.expire(validators_key, CACHE_TTL)
+    pipe.execute()
+
+
 def fetch_with_backoff(url):
-    """Fetch the URL, applying per-domain delay + retry/backoff on 429."""
-    # ─── Redis cache lookup (skip all backoff/delays on cache hit) ─────────
+    """Fetch the URL, applying per-domain delay + retry/backoff on 429.
+
+    Returns the raw feed body, or None on error. The last response body is
+    kept in Redis together with its ETag / Last-Modified validators, and every
+    refetch is a conditional GET: a 304 reuses the cached body instead of
+    downloading the feed again.
+    """
+    # ─── Redis cache lookup: cached body + validators for a conditional GET ─
     key = f"rss:{url}"
+    validators_key = f"rss:validators:{url}"
     cached = r.get(key)
+    conditional_headers = {}
     if cached:
-        return feedparser.parse(cached)
+        validators = r.hgetall(validators_key)
+        if b"etag" in validators:
+            conditional_headers["If-None-Match"] = validators[b"etag"].decode()
+        if b"last_modified" in validators:
+            conditional_headers["If-Modified-Since"] = validators[
+                b"last_modified"
+            ].decode()
 
-    # 0) Global QPM rate-limit
-    _consume_token()
     # 1) Domain-based delay
     domain = extract_domain(url)
 
@@ -100,9 +147,9 @@ def fetch_with_backoff(url):
     backoff = INITIAL_BACKOFF
     while True:
         try:
-            # re-apply rate limit on each retry
+            # global QPM rate-limit: one token per request sent, retries included
             _consume_token()
-            resp = session.get(url)
+            resp = session.get(url, headers=conditional_headers)
             if resp.status_code == 429:
                 # honor Retry-After if given, else use backoff
                 ra = resp.headers.get("Retry-After")
@@ -112,36 +159,193 @@ def fetch_with_backoff(url):
                 backoff = min(backoff * BACKOFF_FACTOR, MAX_BACKOFF)
                 continue
 
+            if resp.status_code == 304 and cached:
+                # unchanged since last fetch: keep the cached body alive
+                r.expire(key, CACHE_TTL)
+                r.expire(validators_key, CACHE_TTL)
+                return cached
+
             resp.raise_for_status()
-            # ─── Cache the raw feed bytes for 1 hour ───────────────────────
-            r.set(key, resp.content, ex=3600)
-            return feedparser.parse(resp.content)
+            # ─── Cache the raw feed bytes + validators for the next refetch ─
+            _store_response(key, validators_key, resp)
+            return resp.content
 
         except requests.RequestException as e:
             print(f"Error fetching {url}: {e}")
             return None
 
 
+def normalise_entries(feed_entries):
+    """Turn feedparser entries into (dedup key, entry dict) pairs.
+
+    Each entry is a plain dict with the keys the filter and clean stages read:
+    id, title, link, published, description and the UTC epoch timestamp, plus
+    author and tags (a list of category terms) when the feed has them.
+    """
+    normalised = []
+    for entry in feed_entries:
+        entry_link = entry.get("link")
+        entry_title = entry.get("title", "")
+        entry_published = entry.get("published", "")
+
+        # Use link if available, otherwise fall back to title+published
+        entry_key = entry_link if entry_link else f"{entry_title}_{entry_published}"
+
+        # generate a deterministic unique hash (GUID) for the entry
+        hash_input = entry.get("id", entry.get("link", "")).encode("utf-8")
+        unique_hash = hashlib.sha256(hash_input).hexdigest()
+
+        # pick published or updated timestamp string
+        date_str = entry.get("published") or entry.get("updated")
+        # parse into an epoch timestamp (handles RFC-822, ISO8601, etc.);
+        # this is the one date every later stage sorts and formats from
+        timestamp = parse_timestamp(date_str) if date_str else None
+        if timestamp is None:
+            # fallback to the time we first saw the entry
+            timestamp = int(time.time())
+
+        # Prefer full HTML <content:encoded> if present, otherwise fallback to summary
+        if "content" in entry and entry.content:
+            raw_html = entry.content[0].value
+        else:
+            raw_html = entry.get("summary", "")
+
+        fields = {
+            "id": unique_hash,
+            "title": entry_title or "No Title",
+            "link": entry_link or "",
+            "published": format_timestamp(timestamp),
+            "timestamp": timestamp,
+            "description": raw_html,
+        }
+        # what the author: and tags: filter scopes match against
+        if entry.get("author"):
+            fields["author"] = entry["author"]
+        if entry.get("tags"):
+            fields["tags"] = [tag.get("term", "") for tag in entry["tags"]]
+        normalised.append([entry_key, fields])
+    return normalised
+
+
+def _entries_key(digest):
+    return f"rss:entries:{NORMALISE_VERSION}:{digest}"
+
+
+def parse_entries(body, digest=None):
+    """Parse a feed body into normalised entries, via the Redis entry cache.
+
+    Returns (entries, refresh hint), the hint being the interval the feed
+    asks to be polled at (see feed_schedule.publisher_interval). The cache is
+    keyed by a hash of the body, so an unchanged feed (a 304 or an identical
+    200) skips feedparser entirely.
+    """
+    digest = digest or hashlib.sha256(body).hexdigest()
+    key = _entries_key(digest)
+    cached = r.get(key)
+    if cached:
+        r.expire(key, CACHE_TTL)
+        parsed = json.loads(zlib.decompress(cached))
+        return parsed["entries"], parsed["refresh"]
+
+    parsed = feedparser.parse(body)
+    entries = normalise_entries(parsed.entries)
+    hint = feed_schedule.publisher_interval(parsed.feed)
+    payload = json.dumps(
+        {"entries": entries, "refresh": hint}, separators=(",", ":")
+    ).encode("utf-8")
+    r.set(key, zlib.compress(payload), ex=CACHE_TTL)
+    return entries, hint
+
+
+def flush_entry_cache():
+    """Drop every cached entry list, whatever its NORMALISE_VERSION."""
+    removed = 0
+    for key in r.scan_iter(match="rss:entries:*", count=500):
+        removed += r.delete(key)
+    print(f"Removed {removed} cached entry lists.")
+
+
+def fetch_entries(url):
+    """Fetch a feed and schedule its next fetch.
+
+    Returns (entries, changed): changed is True if the body differs from the
+    previous fetch. When the fetch fails, entries are those of the last
+    cached body (None if there is none), so a feed that is briefly down does
+    not drop out of the merged output.
+    """
+    body = fetch_with_backoff(url)
+    now = time.time()
+    if body is None:
+        feed_schedule.record_failure(r, url, now)
+        return cached_entries(url), False
+    digest = hashlib.sha256(body).hexdigest()
+    entries, hint = parse_entries(body, digest)
+    changed, replaced = feed_schedule.record_fetch(
+        r, url, digest, entries, hint, now
+    )
+    if replaced is not None:
+        # nothing reads the superseded body's entries again; don't leave them
+        # to the TTL, or a feed that changes every fetch piles up lists
+        r.delete(_entries_key(replaced))
+    return entries, changed
+
+
+def cached_entries(url):
+    """Return the entries of the last fetched body of a feed without fetching
+    it, or None if no body is cached."""
+    body = r.get(f"rss:{url}")
+    if body is None:
+        return None
+    return parse_entries(body)[0]
+
+
+def fetch_domain_feeds(urls):
+    """Fetch all feeds of one domain sequentially; returns (url, entries,
+    changed) triples."""
+    return [(url, *fetch_entries(url)) for url in urls]
+
+
+def fetch_all(feed_urls, workers=FETCH_WORKERS):
+    """Fetch feeds concurrently across domains.
+
+    Returns a url → entries dict and the set of urls whose body changed.
+    """
+    by_domain = {}
+    for url in feed_urls:
+        by_domain.setdefault(extract_domain(url), []).append(url)
+    # start the domains with the most feeds first; they bound the cycle time
+    queues = sorted(by_domain.values(), key=len, reverse=True)
+
+    feeds = {}
+    changed = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for triples in pool.map(fetch_domain_feeds, queues):
+            for url, entries, feed_changed in triples:
+                feeds[url] = entries
+                if feed_changed:
+                    changed.add(url)
+    return feeds, changed
+
+
 def validate_url(url):
     """Validate the structure of a URL."""
     parsed = urlparse(url)
     return parsed.scheme in ("http", "https") and bool(parsed.netloc)
 
 
-def merge_feeds(feeds_file, output_file):
-    """Fetch multiple RSS/Atom feeds, merge entries, and write to an output file."""
-    total_entries = 0
-    seen_entries = set()  # Store keys we've seen (link or fallback ID)
+# Channel metadata for the merged feed; carried alongside the entries when the
+# pipeline runs in-process so the later stages see the same values they would
+# read back out of merged_feed.xml.
+FEED_META = {
+    "title": "Merged Feed",
+    "link": "http://example.com",
+    "description": "This is a merged feed.",
+    "language": "en",
+}
 
-    fg = FeedGenerator()
-    fg.title("Merged Feed")
-    fg.link(href="http://example.com", rel="alternate")
-    fg.description("This is a merged feed.")
-    fg.language("en")
-    fg.docs("http://www.rssboard.org/rss-specification")
-    fg.generator("python-feedgen")
 
-    # Read the list of feed URLs
+def read_feed_urls(feeds_file):
+    """Return the valid feed URLs listed in feeds_file, sorted by domain."""
     with open(feeds_file, "r") as f:
         feed_urls = [
             line.strip() for line in f if line.strip() and not line.startswith("#")
@@ -154,75 +358,158 @@ def merge_feeds(feeds_file, output_file):
     for url in feed_urls:
         if not validate_url(url):
             print(f"Skipping invalid URL: {url}")
-            continue
+    return [url for url in feed_urls if validate_url(url)]
+
+
+def merge_entries(feed_urls, feeds, store_path=None, changed=None):
+    """Merge the url → entries dict `feeds` in feed_urls order and return the
+    de-duplicated entries.
 
-        feed = fetch_with_backoff(url)
-        if not feed or not feed.entries:
+    With `store_path`, entries are de-duplicated against the persistent entry
+    store instead of in memory: only entries it has not seen before are
+    written, and the result is read back from the store. `changed` is the set
+    of feeds whose body changed since it was last ingested; the others keep
+    the listing they already have in the store. None means all of them.
+    """
+    entries = []
+    seen_entries = set()  # Store keys we've seen (link or fallback ID)
+    ingested = []  # feeds whose entries went into the store
+    store = entry_store.open_store(store_path) if store_path else None
+    cycle_ts = time.time()
+    new_entries = 0
+
+    for url in feed_urls:
+        feed_entries = feeds.get(url)
+        if not feed_entries:
             print(f"No entries for {url}, skipping.")
             continue
 
         ts = datetime.now().strftime("%H:%M:%S")
         print(
-            f"{ts}: Importing: {url} ({len(feed.entries)} entries)",
+            f"{ts}: Importing: {url} ({len(feed_entries)} entries)",
             end="\r",
             flush=True,
         )
-        if len(feed.entries) == 0:
-            print(
-                f"Debug: No entries found in feed {url}. Feed content: {pprint.pformat(feed)}"
+
+        if store is not None:
+            new_entries += entry_store.ingest(
+                store, url, feed_entries, cycle_ts, changed is None or url in changed
             )
+            ingested.append(url)
             continue
 
-        for entry in feed.entries:
-            entry_link = entry.get("link")
-            entry_title = entry.get("title", "")
-            entry_published = entry.get("published", "")
-
-            # Use link if available, otherwise fall back to title+published
-            entry_key = entry_link if entry_link else f"{entry_title}_{entry_published}"
+        for entry_key, entry in feed_entries:
             if entry_key in seen_entries:
                 continue  # Skip duplicates
             seen_entries.add(entry_key)
+            entries.append(entry)
 
-            fe = fg.add_entry()
-            # generate a deterministic unique hash (GUID) for the entry
-            hash_input = entry.get("id", entry.get("link", "")).encode("utf-8")
-            unique_hash = hashlib.sha256(hash_input).hexdigest()
-            fe.guid(unique_hash, permalink=False)
-            fe.title(entry_title or "No Title")
-            if entry_link:
-                fe.link(href=entry_link, rel="alternate", type="text/html")
-
-            # pick published or updated timestamp string
-            date_str = entry.get("published") or entry.get("updated")
-            if date_str:
-                # parse into a datetime (handles RFC-822, ISO8601, etc.)
-                pub_dt = parse(date_str)  # :contentReference[oaicite:1]{index=1}
-            else:
-                # fallback to a true datetime object
-                pub_dt = datetime.now(timezone.utc)
-
-            # feedgen.pubDate accepts a datetime, and will format it correctly
-            fe.pubDate(pub_dt)
-
-            # Prefer full HTML <content:encoded> if present, otherwise fallback to summary
-            if "content" in entry and entry.content:
-                raw_html = entry.content[0].value
-            else:
-                raw_html = entry.get("summary", "")
-
-            # Emit the HTML inside a CDATA-wrapped <content:encoded> element
+    print()
+    if store is not None:
+        entry_store.retire_feeds(store, ingested, cycle_ts)
+        store.commit()
+        entries = entry_store.current_entries(store)
+        pruned = entry_store.prune(store, cycle_ts)
+        store.close()
+        print(f"Entry store: {new_entries} new, {pruned} expired.")
+    return entries
+
+
+def collect_entries(feeds_file, workers=FETCH_WORKERS, store_path=None):
+    """Fetch multiple RSS/Atom feeds and return the merged, de-duplicated entries."""
+    feed_urls = read_feed_urls(feeds_file)
+    # fetch everything up front, then merge in the sorted order so the
+    # de-duplication stays deterministic
+    feeds, _ = fetch_all(feed_urls, workers)
+    return merge_entries(feed_urls, feeds, store_path)
+
+
+def collect_due_entries(
+    feeds_file, workers=FETCH_WORKERS, store_path=None, force=False
+):
+    """Like collect_entries(), but only fetch the feeds that are due.
+
+    Feeds that are not due contribute the entries of their cached body.
+    Returns None without merging when no fetched feed changed, since the
+    merged entries would be the same as last time, unless `force` is set;
+    the cached bodies are only read once there is something to merge.
+    """
+    feed_urls = read_feed_urls(feeds_file)
+    due = set(feed_schedule.due_feeds(r, feed_urls, time.time()))
+    feeds, changed = fetch_all([url for url in feed_urls if url in due], workers)
+    if not changed and not force:
+        print(f"Fetched {len(due)} of {len(feed_urls)} feeds; none changed.")
+        return None
+
+    expired = []
+    for url in feed_urls:
+        if url not in due:
+            feeds[url] = cached_entries(url)
+            if feeds[url] is None:
+                expired.append(url)  # its body expired from the cache
+    if expired:
+        fetched, expired_changed = fetch_all(expired, workers)
+        feeds.update(fetched)
+        changed |= expired_changed
+    print(
+        f"Fetched {len(due) + len(expired)} of {len(feed_urls)} feeds;"
+        f" {len(changed)} changed."
+    )
+    # a forced cycle may be redoing one that died before its changes were
+    # ingested, so it ingests every feed in full
+    return merge_entries(feed_urls, feeds, store_path, None if force else changed)
+
+
+def write_merged_feed(entries, output_file):
+    """Write merged entries to an RSS file (the merged_feed.xml format)."""
+    with rss_writer(
+        output_file,
+        FEED_META["title"],
+        FEED_META["link"],
+        FEED_META["description"],
+        FEED_META["language"],
+        generator="not-the-news merge",
+    ) as write_item:
+        # newest additions first, the order feedgen's prepending add_entry() gave
+        for entry in reversed(entries):
+            # the HTML goes into a CDATA-wrapped <description>
             # (so the downstream cleaner can pick up real <p>, <ul>, <li>, etc.)
-            fe.content(raw_html, type="CDATA")
-
-            total_entries += 1
+            write_item(
+                entry["id"],
+                entry["title"],
+                entry["link"],
+                # entries stored before timestamps were added only have the string
+                entry.get("timestamp", entry["published"]),
+                entry["description"],
+                author=entry.get("author"),
+                categories=entry.get("tags", []),
+            )
 
-    merged_feed = fg.rss_str(pretty=True)
-    with open(output_file, "wb") as out:
-        out.write(merged_feed)
 
-    print()
-    print(f"Merged feed saved to '{output_file}' with {total_entries} entries.")
+def merge_feeds(
+    feeds_file,
+    output_file,
+    workers=FETCH_WORKERS,
+    store_path=None,
+    scheduled=False,
+    force=False,
+):
+    """Fetch multiple RSS/Atom feeds, merge entries, and write to an output file.
+
+    With `scheduled`, only due feeds are fetched (see collect_due_entries())
+    and nothing is written when none of them changed. Returns True if the
+    output file was written.
+    """
+    if scheduled:
+        entries = collect_due_entries(feeds_file, workers, store_path, force)
+        if entries is None:
+            print("No feed changed; merged feed left as is.")
+            return False
+    else:
+        entries = collect_entries(feeds_file, workers, store_path)
+    write_merged_feed(entries, output_file)
+    print(f"Merged feed saved to '{output_file}' with {len(entries)} entries.")
+    return True
 
 
 if __name__ == "__main__":
@@ -235,5 +522,36 @@ if __name__ == "__main__":
     parser.add_argument(
         "--output", required=True, help="Path to save the merged feed XML."
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=FETCH_WORKERS,
+        help="Number of domains to fetch in parallel.",
+    )
+    parser.add_argument(
+        "--store",
+        help="Path to the persistent entry store (SQLite); merged in memory if omitted.",
+    )
+    parser.add_argument(
+        "--scheduled",
+        action="store_true",
+        help=f"Only fetch feeds that are due; exit with {UNCHANGED_EXIT} if none changed.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="With --scheduled, write the merged feed even if no feed changed.",
+    )
+    parser.add_argument(
+        "--flush-entry-cache",
+        action="store_true",
+        help="Drop all cached parsed entry lists before merging.",
+    )
     args = parser.parse_args()
-    merge_feeds(args.feeds, args.output)
+    if args.flush_entry_cache:
+        flush_entry_cache()
+    written = merge_feeds(
+        args.feeds, args.output, args.workers, args.store, args.scheduled, args.force
+    )
+    if not written:
+        sys.exit(UNCHANGED_EXIT)
@@ -0,0 +1,63 @@
+# Precompressed variants of what the pipeline publishes.
+# feed.xml and the API payloads change at most once per cycle, so they are
+# compressed here at maximum levels instead of by Caddy or the API on every
+# request: feed.xml gets .gz and .br siblings on disk, and the snapshot stores
+# the variants of its payloads next to the plain bodies.
+
+import gzip
+import os
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # without the brotli package only gzip variants are made
+    brotli = None
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+# Content-Encoding → file suffix
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def compress(data):
+    """Return an encoding → bytes dict of the compressed variants of data."""
+    # mtime=0 keeps the output identical for identical input
+    variants = {"gzip": gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=BROTLI_QUALITY)
+    return variants
+
+
+def _replace(path, data):
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=".",
+        suffix=os.path.basename(path) + ".tmp",
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_precompressed(path, target=None):
+    """Write the .gz and .br siblings of target (path by default) from the
+    content of the file at path.
+
+    Passing the not yet renamed output as path lets the siblings be in place
+    before target itself is replaced, so they are never older than it.
+    """
+    target = target or path
+    with open(path, "rb") as f:
+        variants = compress(f.read())
+    for encoding, suffix in SUFFIXES.items():
+        if encoding in variants:
+            _replace(target + suffix, variants[encoding])
+        elif os.path.exists(target + suffix):
+            # a leftover sibling would be served in place of the new file
+            os.remove(target + suffix)
@@ -1,7 +1,12 @@
 # Certain websites don't present the rss feed entriies in the best way.
 # This module checks if an rss item is from a certain domain and applies cosmetic tweaks to the entry.
 
+import hashlib
+import inspect
+import os
 import re
+import shlex
+import time
 from urllib.parse import urlparse
 from typing import List
 
@@ -119,35 +124,153 @@ def prettify_wired_entry(entry):
     return entry
 
 
-def prettify_images(entry):
-    """Add lazy loading to images and wrap them in anchor tags."""
-    description = entry.get("description", "")
+def append_source_span(entry):
+    """Append the entry's link to its description in a hidden source-url span."""
+    source_url = entry.get("link", "").strip()
+    entry["description"] = (
+        entry.get("description", "") + f'<span class="source-url">{source_url}</span>'
+    )
+    return entry
 
-    # Replace each <img ... src="URL" ...> with a clickable, lazy-loaded image
-    def repl(match):
-        attrs = match.group(1) or ""
-        url = match.group(2)
-        suffix = match.group(3) or ""
-        img_tag = f'<img loading="lazy"{attrs}src="{url}"{suffix}>'
-        return f'<a href="{url}">{img_tag}</a>'
 
-    new_desc = re.sub(r'<img([^>]*?)src="([^"]+)"([^>]*?)>', repl, description)
-    entry["description"] = new_desc
+def strip_title_suffix(entry, suffix):
+    """Strip a trailing suffix (e.g. ' | Site Name') from the title."""
+    title = entry.get("title", "").strip()
+    if title.endswith(suffix):
+        entry["title"] = title[: -len(suffix)]
     return entry
 
 
+def replace_link(entry, old, new):
+    """Replace part of the entry's link, e.g. to redirect to a mirror."""
+    entry["link"] = entry.get("link", "").strip().replace(old, new)
+    return entry
+
+
+# ─── Domain rule registry ─────────────────────────────────────────────────────
+# Handlers a rule can name; each takes the entry plus the rule's arguments.
+HANDLERS = {
+    "reddit": prettify_reddit_entry,
+    "hackernews": prettify_hackernews_entry,
+    "x": prettify_x_entry,
+    "wired": prettify_wired_entry,
+    "source_span": append_source_span,
+    "strip_title_suffix": strip_title_suffix,
+    "replace_link": replace_link,
+}
+
+# Used when data/config/domain_rules.txt does not exist.
+DEFAULT_RULES = """
+reddit.com            reddit
+news.ycombinator.com  hackernews
+x.com                 x
+wired.com             wired
+"""
+
+RULES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "../data/config/domain_rules.txt"
+)
+
+# host suffix → [(label, handler, args)], plus the mtime and a fingerprint of
+# the rules it was loaded from
+_registry = {}
+_registry_mtime = None
+_registry_version = ""
+
+# label → [hits, seconds spent]
+rule_stats = {}
+
+
+def parse_rules(text):
+    """Parse rule lines: `<host suffix> <handler> [args…]` (shell-style quoting).
+
+    A host suffix matches the host itself and all of its subdomains; several
+    lines for the same suffix are applied in file order. Lines that do not
+    parse, or that give a handler the wrong number of arguments, are
+    reported and skipped.
+    """
+    registry = {}
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            print(f"domain rules line {lineno}: {e}, skipped")
+            continue
+        if len(words) < 2:
+            print(f"domain rules line {lineno}: missing suffix or handler, skipped")
+            continue
+        suffix, name, *args = words
+        if name not in HANDLERS:
+            print(f"domain rules line {lineno}: unknown handler {name!r}, skipped")
+            continue
+        try:
+            # the entry is passed first, then the rule's arguments
+            inspect.signature(HANDLERS[name]).bind(None, *args)
+        except TypeError:
+            print(
+                f"domain rules line {lineno}: wrong number of arguments"
+                f" for {name!r}, skipped"
+            )
+            continue
+        label = f"{suffix} {name}"
+        registry.setdefault(suffix.lower(), []).append((label, HANDLERS[name], args))
+    return registry
+
+
+def load_domain_rules(path=RULES_PATH):
+    """(Re)load the rule registry if the rules file changed since the last load."""
+    global _registry, _registry_mtime, _registry_version
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = 0
+    if _registry_mtime == mtime:
+        return
+    text = DEFAULT_RULES
+    if mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    _registry = parse_rules(text)
+    _registry_mtime = mtime
+    _registry_version = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def rules_version():
+    """Fingerprint of the loaded rules, for caches of prettified output."""
+    load_domain_rules()
+    return _registry_version
+
+
+def lookup_rules(hostname):
+    """Return the rules for the longest registered suffix of hostname."""
+    labels = hostname.lower().rstrip(".").split(".")
+    for i in range(len(labels)):
+        rules = _registry.get(".".join(labels[i:]))
+        if rules:
+            return rules
+    return []
+
+
+def report_rule_stats():
+    """Print per-rule hit counts and time spent, most expensive first."""
+    for label, (hits, seconds) in sorted(
+        rule_stats.items(), key=lambda kv: kv[1][1], reverse=True
+    ):
+        print(f"domain rule {label}: {hits} hits, {seconds * 1000:.1f} ms")
+
+
 # Dispatcher
 def prettify_domains(entry):
-    # Global post-processing: images
-    entry = prettify_images(entry)
-    # Wrap crazy long titles
-    new_title = wrap_title(entry, max_len=60)
-    entry["title"] = new_title
-
     """
     Inspect entry['link'], figure out the domain,
-    and call the corresponding prettify function.
+    and apply the rules registered for it.
     """
+    # (images are rewritten by clean_feed's single-pass HTML rewrite)
+    if _registry_mtime is None:
+        load_domain_rules()
     link = entry.get("link", "")
     hostname = ""
     try:
@@ -155,18 +278,14 @@ def prettify_domains(entry):
     except Exception:
         pass
 
-    # Normalize to just the main domain
-    domain = hostname.lower().removeprefix("www.")
-
-    if "reddit.com" in domain:
-        return prettify_reddit_entry(entry)
-    if "news.ycombinator.com" in domain:
-        return prettify_hackernews_entry(entry)
-    if "x.com" in domain:
-        return prettify_x_entry(entry)
-    if "wired.com" in domain:
-        return prettify_wired_entry(entry)
-    # add more domains here:
-    # if domain == 'twitter.com': return prettify_twitter_entry(entry)
+    for label, handler, args in lookup_rules(hostname):
+        start = time.perf_counter()
+        entry = handler(entry, *args)
+        stats = rule_stats.setdefault(label, [0, 0.0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
 
+    # Wrap crazy long titles, once the rules have settled the plain title
+    # and the link it points to
+    entry["title"] = wrap_title(entry, max_len=60)
     return entry
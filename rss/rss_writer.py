@@ -0,0 +1,114 @@
+# Streaming RSS 2.0 writer shared by the merge, filter and clean stages.
+# Items are written one at a time to a temporary file next to the output,
+# which is renamed into place once the document is complete, so readers never
+# see a half-written feed and memory use does not grow with the item count.
+
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from xml.sax.saxutils import escape
+
+from dates import parse_timestamp, format_timestamp
+
+# namespace of the pipeline's own item elements
+NTN_NS = "https://github.com/timjefferies/not-the-news"
+
+# characters that are not allowed anywhere in an XML 1.0 document
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _text(value):
+    """Escape a value for use as element text."""
+    return escape(_INVALID_XML_CHARS.sub("", str(value)))
+
+
+def _cdata(value):
+    """Wrap a value in CDATA, splitting any "]]>" it contains."""
+    value = _INVALID_XML_CHARS.sub("", str(value))
+    return "<![CDATA[" + value.replace("]]>", "]]]]><![CDATA[>") + "]]>"
+
+
+def format_rfc822(value):
+    """Format an epoch timestamp (or a date string) as an RFC-822 date in UTC.
+
+    Strings that cannot be parsed are passed through unchanged.
+    """
+    if isinstance(value, str):
+        ts = parse_timestamp(value)
+        if ts is None:
+            return _text(value)
+        value = ts
+    return format_timestamp(value)
+
+
+@contextmanager
+def rss_writer(
+    output_file,
+    title,
+    link,
+    description,
+    language="en",
+    generator=None,
+    before_replace=None,
+):
+    """Open an RSS document at output_file and yield a write_item() function.
+
+    write_item(guid, title, link, pub_date, description, author=None,
+    categories=(), timestamp=None) emits one <item>; pub_date may be an epoch
+    timestamp or a date string, and a timestamp is also written as
+    <ntn:timestamp> so readers need not parse pubDate. The file only replaces
+    output_file when the block exits without an exception; before that,
+    before_replace (if given) is called with the path of the finished file.
+    """
+    out_dir = os.path.dirname(os.path.abspath(output_file))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=out_dir, prefix=".", suffix=os.path.basename(output_file) + ".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+            f.write(f'<rss version="2.0" xmlns:ntn="{NTN_NS}">\n  <channel>\n')
+            f.write(f"    <title>{_text(title)}</title>\n")
+            f.write(f"    <link>{_text(link)}</link>\n")
+            f.write(f"    <description>{_text(description)}</description>\n")
+            f.write("    <docs>http://www.rssboard.org/rss-specification</docs>\n")
+            if generator:
+                f.write(f"    <generator>{_text(generator)}</generator>\n")
+            f.write(f"    <language>{_text(language)}</language>\n")
+
+            def write_item(guid, title, link, pub_date, description,
+                           author=None, categories=(), timestamp=None):
+                parts = ["    <item>\n"]
+                parts.append(f"      <title>{_text(title)}</title>\n")
+                if link:
+                    parts.append(f"      <link>{_text(link)}</link>\n")
+                parts.append(f"      <description>{_cdata(description)}</description>\n")
+                if author:
+                    parts.append(f"      <author>{_text(author)}</author>\n")
+                for term in categories:
+                    parts.append(f"      <category>{_text(term)}</category>\n")
+                if guid:
+                    parts.append(f'      <guid isPermaLink="false">{_text(guid)}</guid>\n')
+                if pub_date:
+                    parts.append(f"      <pubDate>{format_rfc822(pub_date)}</pubDate>\n")
+                if timestamp is not None:
+                    parts.append(
+                        f"      <ntn:timestamp>{int(timestamp)}</ntn:timestamp>\n"
+                    )
+                parts.append("    </item>\n")
+                f.write("".join(parts))
+
+            yield write_item
+
+            f.write("  </channel>\n</rss>\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        if before_replace is not None:
+            before_replace(tmp_path)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
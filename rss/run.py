@@ -14,9 +14,17 @@ feed_dir = os.path.join(SCRIPT_DIR, "../data/feed/")
 merged_file = os.path.join(feed_dir, "merged_feed.xml")
 merged_log_file = os.path.join(SCRIPT_DIR, "../data/feed/merged_feeds.log")
 filtered_file = os.path.join(feed_dir, "filtered_feed.xml")
+entry_store_file = os.path.join(feed_dir, "entries.db")
 final_feed_file = os.path.join(feed_dir, "feed.xml")
 feeds_path = os.path.join(SCRIPT_DIR, "../data/config/feeds.txt")
 keywords_path = os.path.join(SCRIPT_DIR, "../data/config/filter_keywords.txt")
+domain_rules_path = os.path.join(SCRIPT_DIR, "../data/config/domain_rules.txt")
+# exists while a cycle that may have seen changed feeds has not published them
+publish_pending_file = os.path.join(feed_dir, ".publish-pending")
+
+# exit status of merge_feeds.py --scheduled when no feed changed (its
+# UNCHANGED_EXIT; not imported so this mode never loads merge_feeds)
+MERGE_UNCHANGED = 3
 
 # --- Ensure feed directory exists ---
 if not os.path.exists(feed_dir):
@@ -38,19 +46,113 @@ def is_merge_running():
         == 0
     )
 
-def generate_feed():
-    if os.path.exists(final_feed_file):
-        age = time.time() - os.path.getmtime(final_feed_file)
-        if age < 5 * 60:  # 30 minutes in seconds
-            mins = age / 60
-            print(
-                f"{final_feed_file} is only {mins:.1f} minutes old; skipping this cycle."
-            )
-            return
+def republish_needed():
+    """Return True if feed.xml must be rebuilt even when no feed changed: it
+    is missing, an earlier cycle failed before publishing what it fetched, or
+    the feed list, filter keywords or domain rules were edited since."""
+    if not os.path.exists(final_feed_file) or os.path.exists(publish_pending_file):
+        return True
+    published = os.path.getmtime(final_feed_file)
+    return any(
+        os.path.exists(path) and os.path.getmtime(path) > published
+        for path in (feeds_path, keywords_path, domain_rules_path)
+    )
+
+
+def any_feed_due():
+    """Return True if some feed in feeds.txt is due for a fetch, or if that
+    cannot be told. Reads the schedule straight from Redis, so the subprocess
+    mode does not start merge_feeds.py (and its imports) on idle ticks."""
+    import redis
+    from urllib.parse import urlparse
+    import feed_schedule
+
+    try:
+        with open(feeds_path, "r") as f:
+            urls = [
+                line.strip() for line in f if line.strip() and not line.startswith("#")
+            ]
+    except OSError:
+        return True
+    # same filter as merge_feeds.validate_url; an invalid URL is never fetched,
+    # so it must not count as due
+    parsed = [(url, urlparse(url)) for url in urls]
+    urls = [url for url, p in parsed if p.scheme in ("http", "https") and p.netloc]
+    try:
+        r = redis.Redis(host="localhost", port=6379, db=0)
+        return bool(feed_schedule.due_feeds(r, urls, time.time()))
+    except redis.RedisError:
+        return True
+
+
+def generate_feed(in_process=False, debug_intermediate=False, clean_workers=1):
+    # feeds are fetched on their own schedules (see feed_schedule.py), so a
+    # cycle only costs something when a feed is due
     if is_merge_running():
         print("merge_feeds.py is already running; skipping this cycle.")
         return
-    """Run the original pipeline via CLI scripts and sed replacements."""
+
+    force = republish_needed()
+    if not in_process and not force and not any_feed_due():
+        print("No feed is due; skipping this cycle.")
+        return
+    # The merge records each feed's new body as seen as soon as it fetches
+    # it, so a cycle that dies before feed.xml is written would otherwise
+    # leave those changes unpublished until some other feed changes. The
+    # marker is only removed once nothing is left to publish.
+    open(publish_pending_file, "w").close()
+    if in_process:
+        updated = run_pipeline_in_process(debug_intermediate, clean_workers, force)
+    else:
+        updated = run_pipeline_subprocess(clean_workers, force)
+    os.remove(publish_pending_file)
+
+    if updated:
+        print("Feed updated successfully")
+    else:
+        print("No feed changed; feed.xml left as is.")
+
+
+def run_pipeline_in_process(debug_intermediate=False, clean_workers=1, force=False):
+    """Run merge → filter → clean in this interpreter, passing entries in memory.
+
+    Only feed.xml is written; merged_feed.xml and filtered_feed.xml are also
+    written when debug_intermediate is set. Only due feeds are fetched, and
+    nothing is written when none of them changed unless `force` is set.
+    Returns True if feed.xml was written.
+    """
+    # imported lazily so the subprocess mode never pays for them; after the
+    # first cycle they come straight from sys.modules
+    from merge_feeds import FEED_META, collect_due_entries, write_merged_feed
+    from filter_feed import load_filter_rules, filter_entries, write_filtered_feed
+    from clean_feed import prepare_entries, write_clean_feed
+
+    # 1) Merge
+    entries = collect_due_entries(feeds_path, store_path=entry_store_file, force=force)
+    if entries is None:
+        return False
+    print(f"Merged {len(entries)} entries.")
+    if debug_intermediate:
+        write_merged_feed(entries, merged_file)
+
+    # 2) Filter
+    rules = load_filter_rules(keywords_path)
+    entries = filter_entries(entries, rules)
+    if debug_intermediate:
+        write_filtered_feed(FEED_META, entries, filtered_file)
+
+    # 3) Clean
+    entries = prepare_entries(entries, clean_workers)
+    write_clean_feed(FEED_META, entries, final_feed_file)
+    print(f"Cleaned feed saved to '{final_feed_file}' with {len(entries)} entries.")
+    return True
+
+
+def run_pipeline_subprocess(clean_workers=1, force=False):
+    """Run the original pipeline via CLI scripts and sed replacements.
+
+    Returns True if feed.xml was written; see run_pipeline_in_process().
+    """
 
     # 1) Merge
     with open(merged_log_file, "w") as log_file:
@@ -62,7 +164,11 @@ def generate_feed():
                 feeds_path,
                 "--output",
                 merged_file,
-            ],
+                "--store",
+                entry_store_file,
+                "--scheduled",
+            ]
+            + (["--force"] if force else []),
             cwd=SCRIPT_DIR,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
@@ -76,6 +182,8 @@ def generate_feed():
 
         process.wait()
 
+        if process.returncode == MERGE_UNCHANGED:
+            return False
         if process.returncode != 0:
             raise subprocess.CalledProcessError(process.returncode, process.args)
 
@@ -104,6 +212,8 @@ def generate_feed():
             filtered_file,
             "--output",
             final_feed_file,
+            "--workers",
+            str(clean_workers),
         ],
         check=True,
         cwd=SCRIPT_DIR,
@@ -114,8 +224,7 @@ def generate_feed():
     #        ['sed','-i','s/img src/img loading="lazy" src/g', final_feed_file],
     #        check=True
     #    )
-
-    print("Feed updated successfully")
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description="Not-the-News feed generator")
@@ -123,7 +232,26 @@ def main():
         "--daemon", action="store_true", help="Run continuously in daemon mode"
     )
     parser.add_argument(
-        "--interval", type=int, default=300, help="Seconds between runs in daemon mode"
+        "--interval",
+        type=int,
+        default=60,
+        help="Seconds between checks for due feeds in daemon mode",
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run all pipeline stages in this process instead of one subprocess each",
+    )
+    parser.add_argument(
+        "--debug-intermediate",
+        action="store_true",
+        help="With --in-process, also write merged_feed.xml and filtered_feed.xml",
+    )
+    parser.add_argument(
+        "--clean-workers",
+        type=int,
+        default=1,
+        help="Processes used by the clean stage to sanitize entries in parallel",
     )
     args = parser.parse_args()
 
@@ -131,13 +259,15 @@ def main():
         print(f"Starting in daemon mode (interval={args.interval}s)")
         try:
             while True:
-                generate_feed()
+                generate_feed(
+                    args.in_process, args.debug_intermediate, args.clean_workers
+                )
                 time.sleep(args.interval)
         except KeyboardInterrupt:
             print("Daemon shutdown requested; exiting.")
             sys.exit(0)
     else:
-        generate_feed()
+        generate_feed(args.in_process, args.debug_intermediate, args.clean_workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,7 +4,19 @@ from xml.etree import ElementTree as ET
 from email.utils import parsedate_to_datetime
 from werkzeug.middleware.proxy_fix import ProxyFix
 import os
+import re
 import json, secrets
+import base64
+import hashlib
+import sqlite3
+import threading
+from time import monotonic
+from contextlib import closing
+from html import unescape
+
+import user_state_store
+# shared with the pipeline (rss/, on PYTHONPATH in the image)
+from html_rewrite import text_preview
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # Trust X-Forwarded headers
@@ -79,8 +91,13 @@ def _load_feed_items():
     for it in root.findall(".//item"):
         guid = it.findtext("guid") or it.findtext("link")
         raw_date = it.findtext("pubDate") or ""
+        # the pipeline stores the normalised epoch timestamp next to pubDate
+        timestamp = it.findtext("timestamp")
         try:
-            dt = parsedate_to_datetime(raw_date)
+            if timestamp:
+                dt = datetime.fromtimestamp(int(timestamp), timezone.utc)
+            else:
+                dt = parsedate_to_datetime(raw_date)
             pub_iso = dt.astimezone(timezone.utc).isoformat()
         except Exception:
             pub_iso = raw_date
@@ -95,6 +112,274 @@ def _load_feed_items():
     return items
 
 
+# ─── Feed index ─────────────────────────────────────────────────────────────
+# The pipeline writes items.db next to feed.xml: an SQLite snapshot keyed by
+# GUID. When it is present /items does key lookups in it; otherwise feed.xml
+# is parsed. Either way the GUID list is built once per change of the files
+# (keyed by inode/mtime/size) and shared by all requests; the lock makes
+# concurrent threads wait for a single rebuild.
+#
+# The snapshot also records the feed generation and the GUIDs added/removed
+# by recent generations, from which /guids?since=<generation> answers deltas,
+# and carries the /guids body precompressed by the pipeline.
+ITEMS_DB = os.path.join(FEED_DIR, "items.db")
+SNAPSHOT_VERSION = 5  # must match rss/item_snapshot.py
+# Content-Encodings of precompressed payloads, preferred first
+PRECOMPRESSED_ENCODINGS = ("br", "gzip")
+_NOT_LOADED = object()
+_feed_index = {"key": _NOT_LOADED}
+_feed_index_lock = threading.Lock()
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _open_snapshot():
+    """Open items.db read-only; None if it is missing or of another version."""
+    try:
+        # a streamed response may be iterated from different threads (see
+        # asgi.py), one chunk at a time, so the connection is not pinned
+        conn = sqlite3.connect(
+            f"file:{ITEMS_DB}?mode=ro", uri=True, check_same_thread=False
+        )
+        if conn.execute("PRAGMA user_version").fetchone()[0] == SNAPSHOT_VERSION:
+            return conn
+        conn.close()
+    except sqlite3.Error:
+        pass
+    return None
+
+
+def _get_feed_index():
+    """Return the current feed index, rebuilding it if the feed changed."""
+    global _feed_index
+    key = (_file_key(ITEMS_DB), _file_key(FEED_XML))
+    index = _feed_index
+    if index["key"] == key:
+        return index
+    with _feed_index_lock:
+        if _feed_index["key"] != key:
+            conn = _open_snapshot()
+            if conn is not None:
+                with closing(conn):
+                    guids_encoded = dict(
+                        conn.execute(
+                            "SELECT encoding, body FROM payloads WHERE name = 'guids'"
+                        )
+                    )
+                    meta = dict(conn.execute("SELECT key, value FROM meta"))
+                guids_body = guids_encoded.pop("identity").decode("utf-8")
+                items = None  # looked up in the snapshot per request
+            else:
+                items = _load_feed_items()
+                guids_body = json.dumps(list(items.keys()), separators=(",", ":"))
+                guids_encoded = {}
+                meta = {}  # feed.xml carries no generations
+            _feed_index = {
+                "key": key,
+                "items": items,
+                "guids_body": guids_body,
+                "guids_encoded": guids_encoded,
+                "guids_etag": hashlib.sha256(guids_body.encode("utf-8")).hexdigest(),
+                "generation": meta.get("generation"),
+                "base": meta.get("base"),
+            }
+        return _feed_index
+
+
+# stay well below SQLite's bound-parameter limit
+_LOOKUP_CHUNK = 500
+# (snapshot column, item_data key) pairs of each item view: "full" is the
+# original payload, "summary" leaves out the description for a text preview
+# and the first image, and "content" is what a summary is missing
+_VIEWS = {
+    "full": (
+        ("guid", "guid"),
+        ("title", "title"),
+        ("link", "link"),
+        ("pub_date", "pubDate"),
+        ("description", "desc"),
+    ),
+    "summary": (
+        ("guid", "guid"),
+        ("title", "title"),
+        ("link", "link"),
+        ("pub_date", "pubDate"),
+        ("preview", "preview"),
+        ("image", "image"),
+    ),
+    "content": (("guid", "guid"), ("description", "desc")),
+}
+# fallback summaries of feed.xml items, cut like the pipeline's previews
+_HTML_TAG = re.compile(r"<[^>]*>")
+_IMG_SRC = re.compile(r"""<img\b[^>]*?\bsrc=["']([^"']*)""", re.IGNORECASE)
+
+
+def _columns(view):
+    return ", ".join(column for column, _ in _VIEWS[view])
+
+
+def _row_item(row, view):
+    return {key: value for (_, key), value in zip(_VIEWS[view], row)}
+
+
+def _view_item(item, view):
+    """Cut an item_data dict parsed from feed.xml down to a view."""
+    if view == "full":
+        return item
+    if view == "content":
+        return {"guid": item["guid"], "desc": item["desc"]}
+    desc = item["desc"] or ""
+    text = text_preview(unescape(_HTML_TAG.sub(" ", desc)))
+    image = _IMG_SRC.search(desc)
+    summary = {key: item[key] for key in ("guid", "title", "link", "pubDate")}
+    summary.update(preview=text, image=unescape(image.group(1)) if image else "")
+    return summary
+
+
+def _iter_item_chunks(wanted, view="full"):
+    """Yield lists of (guid, item_data) for the wanted GUIDs that exist, in
+    the order they were asked for, a chunk at a time."""
+    all_items = _get_feed_index()["items"]
+    if all_items is not None:
+        for i in range(0, len(wanted), _LOOKUP_CHUNK):
+            chunk = wanted[i : i + _LOOKUP_CHUNK]
+            yield [(g, _view_item(all_items[g], view)) for g in chunk if g in all_items]
+        return
+
+    conn = _open_snapshot()
+    if conn is None:
+        return
+    with closing(conn):
+        for i in range(0, len(wanted), _LOOKUP_CHUNK):
+            chunk = wanted[i : i + _LOOKUP_CHUNK]
+            rows = conn.execute(
+                f"SELECT {_columns(view)} FROM items"
+                f" WHERE guid IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            found = {row[0]: _row_item(row, view) for row in rows}
+            yield [(g, found[g]) for g in chunk if g in found]
+
+
+def _lookup_items(wanted, view="full"):
+    """Return a guid → item_data dict for the wanted GUIDs that exist."""
+    return {g: item for chunk in _iter_item_chunks(wanted, view) for g, item in chunk}
+
+
+# ─── /items pagination ──────────────────────────────────────────────────────
+# Pages are ordered newest pubDate first, ties broken by GUID. The cursor
+# holds the (pubDate, guid) of the last item served, so a page starts right
+# after it even if the feed changed in between.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(item):
+    raw = json.dumps([item["pubDate"], item["guid"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """Return (pubDate, guid) from a cursor; ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        pub_date, guid = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(pub_date, str) or not isinstance(guid, str):
+        raise ValueError("invalid cursor")
+    return pub_date, guid
+
+
+def _iter_page_chunks(wanted, after, limit, view="full"):
+    """Yield lists of item_data for up to limit items after the cursor
+    position `after`, from the wanted GUIDs or the whole feed if None."""
+    all_items = _get_feed_index()["items"]
+    if all_items is not None:
+        selected = (
+            all_items.values()
+            if wanted is None
+            else [all_items[g] for g in dict.fromkeys(wanted) if g in all_items]
+        )
+        page = sorted(selected, key=lambda it: it["guid"] or "")
+        page.sort(key=lambda it: it["pubDate"], reverse=True)
+        if after is not None:
+            page = [
+                it for it in page
+                if it["pubDate"] < after[0]
+                or (it["pubDate"] == after[0] and (it["guid"] or "") > after[1])
+            ]
+        for i in range(0, min(limit, len(page)), _LOOKUP_CHUNK):
+            yield [_view_item(it, view) for it in page[i : min(i + _LOOKUP_CHUNK, limit)]]
+        return
+
+    conn = _open_snapshot()
+    if conn is None:
+        return
+    with closing(conn):
+        where, params = [], []
+        if wanted is not None:
+            # a temporary table keeps the GUID list out of the bound parameters
+            conn.execute("CREATE TEMP TABLE wanted (guid TEXT PRIMARY KEY)")
+            conn.executemany(
+                "INSERT OR IGNORE INTO wanted VALUES (?)", ((g,) for g in wanted)
+            )
+            where.append("guid IN (SELECT guid FROM temp.wanted)")
+        if after is not None:
+            where.append("(pub_date < ? OR (pub_date = ? AND guid > ?))")
+            params += [after[0], after[0], after[1]]
+        rows = conn.execute(
+            f"SELECT {_columns(view)} FROM items"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY pub_date DESC, guid LIMIT ?",
+            params + [limit],
+        )
+        while True:
+            chunk = rows.fetchmany(_LOOKUP_CHUNK)
+            if not chunk:
+                break
+            yield [_row_item(row, view) for row in chunk]
+
+
+def _guid_delta(index, since):
+    """Return (added, removed) GUIDs between generation `since` and the
+    index's generation, or None if the snapshot no longer covers `since` or
+    was replaced since the index was built."""
+    if index["generation"] is None:
+        return None
+    conn = _open_snapshot()
+    if conn is None:
+        return None
+    added, removed = {}, {}
+    with closing(conn):
+        # one read transaction, so the meta row and the change rows come
+        # from the same snapshot even if the pipeline replaces it meanwhile
+        conn.execute("BEGIN")
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get("generation") != index["generation"]:
+            return None  # the full list of the index stays consistent
+        if not meta["base"] <= since <= meta["generation"]:
+            return None
+        rows = conn.execute(
+            "SELECT guid, added FROM changes WHERE generation > ? ORDER BY rowid",
+            (since,),
+        )
+        for guid, was_added in rows:
+            # a GUID removed and re-added in between is simply unchanged
+            if was_added:
+                if removed.pop(guid, None) is None:
+                    added[guid] = True
+            elif added.pop(guid, None) is None:
+                removed[guid] = True
+    return list(added), list(removed)
+
+
 @app.route("/load-config", methods=["GET", "POST"])
 def load_config():
     # Read a text config file from /data/config
@@ -138,66 +423,315 @@ def time():
 
 @app.route("/guids", methods=["GET"])
 def guids():
-    """Return the list of GUIDs in feed.xml."""
-    items = _load_feed_items()
-    return jsonify(list(items.keys())), 200
+    """Return the list of GUIDs in the current feed.
+
+    With ?since=<generation> return {"generation", "added", "removed"}
+    instead, or {"generation", "guids"} with the full list when that
+    generation is too old to compute a delta from.
+    """
+    index = _get_feed_index()
+    if "since" in request.args:
+        return _guids_since(index, request.args.get("since", type=int))
+    encoding = _pick_encoding(index["guids_encoded"])
+    etag = index["guids_etag"]
+    if encoding is not None:
+        # each representation needs its own strong validator
+        etag = f"{etag}-{encoding}"
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    elif encoding is not None:
+        resp = app.response_class(
+            index["guids_encoded"][encoding], mimetype="application/json"
+        )
+        resp.headers["Content-Encoding"] = encoding
+    else:
+        resp = app.response_class(index["guids_body"], mimetype="application/json")
+    resp.set_etag(etag)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+def _pick_encoding(variants):
+    """Return the precompressed encoding the client accepts best, or None."""
+    best, best_quality = None, 0
+    for encoding in PRECOMPRESSED_ENCODINGS:
+        quality = request.accept_encodings[encoding]
+        if encoding in variants and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _guids_since(index, since):
+    generation = index["generation"]
+    delta = _guid_delta(index, since) if since is not None else None
+    if delta is None:
+        body = (
+            f'{{"generation":{json.dumps(generation)},'
+            f'"guids":{index["guids_body"]}}}'
+        )
+        return app.response_class(body, mimetype="application/json")
+    added, removed = delta
+    return jsonify({"generation": generation, "added": added, "removed": removed}), 200
 
 
 @app.route("/items", methods=["GET", "POST"])
 def items():
-    """Given ?guids=a,b,c return JSON map of guid→item_data."""
+    """Given ?guids=a,b,c return JSON map of guid→item_data.
+
+    With ?limit=N (and ?cursor= from the previous page) return one page
+    {"items": [...], "next": cursor or null} of the requested items, or of
+    the whole feed when no GUIDs are given. ?stream=1 sends the response as
+    the items are serialised instead of building it in memory first.
+    ?summary=1 returns title, link, pubDate, a text preview and the first
+    image instead of the description; see /items/content.
+    """
+    wanted = _requested_guids()
+    stream = request.args.get("stream") in ("1", "true")
+    view = "summary" if request.args.get("summary") in ("1", "true") else "full"
+
+    if "limit" not in request.args and "cursor" not in request.args:
+        if stream:
+            return _stream_json(_json_item_map(_iter_item_chunks(wanted, view)))
+        return jsonify(_lookup_items(wanted, view)), 200
+
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    if limit < 1:
+        abort(400, description="limit must be a positive integer")
+    limit = min(limit, MAX_PAGE_SIZE)
+    cursor = request.args.get("cursor")
+    try:
+        after = _decode_cursor(cursor) if cursor else None
+    except ValueError:
+        abort(400, description="Invalid cursor")
+    selection = wanted if request.args.get("guids") or request.method == "POST" else None
+    # one extra item tells whether there is a next page
+    chunks = _iter_page_chunks(selection, after, limit + 1, view)
+    if stream:
+        return _stream_json(_json_page(chunks, limit))
+    page = [item for chunk in chunks for item in chunk]
+    next_cursor = _encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return jsonify({"items": page[:limit], "next": next_cursor}), 200
+
+
+@app.route("/items/content", methods=["GET", "POST"])
+def items_content():
+    """Given ?guids=a,b,c (or POST JSON) return JSON map of guid→{guid, desc},
+    the full content of items fetched as summaries."""
+    wanted = _requested_guids()
+    if request.args.get("stream") in ("1", "true"):
+        return _stream_json(_json_item_map(_iter_item_chunks(wanted, "content")))
+    return jsonify(_lookup_items(wanted, "content")), 200
+
+
+def _requested_guids():
     guids = request.args.get("guids", "")
     wanted = guids.split(",") if guids else []
     # also accept POST JSON
     if request.method == "POST":
         data = request.get_json(force=True)
         wanted = data.get("guids", [])
-    all_items = _load_feed_items()
-    result = {g: all_items[g] for g in wanted if g in all_items}
-    return jsonify(result), 200
+    return [g for g in wanted if isinstance(g, str)]
+
+
+def _stream_json(body):
+    return app.response_class(body, mimetype="application/json")
+
+
+def _json_item_map(chunks):
+    """Serialise (guid, item_data) chunks as one JSON object, piece by piece."""
+    yield "{"
+    sep = ""
+    for chunk in chunks:
+        if chunk:
+            yield sep + ",".join(
+                f"{json.dumps(g)}:{json.dumps(item, sort_keys=True)}" for g, item in chunk
+            )
+            sep = ","
+    yield "}"
+
+
+def _json_page(chunks, limit):
+    """Serialise item_data chunks as a page object, piece by piece."""
+    yield '{"items":['
+    sent, last, next_cursor = 0, None, None
+    for chunk in chunks:
+        if sent + len(chunk) > limit:
+            next_cursor = _encode_cursor(chunk[limit - sent - 1] if limit > sent else last)
+            chunk = chunk[: limit - sent]
+        if chunk:
+            yield ("," if sent else "") + ",".join(
+                json.dumps(item, sort_keys=True) for item in chunk
+            )
+            sent += len(chunk)
+            last = chunk[-1]
+    yield f'],"next":{json.dumps(next_cursor)}}}'
 
 
 # ─── User‐state syncing (hidden/starred/settings) ───────────────────────────
+# State lives in an SQLite store (see user_state_store.py); the per-key JSON
+# files it replaces are imported on first start. Threads share one
+# connection, serialised by the lock.
 #
-def _user_state_path(key):
-    return os.path.join(USER_STATE_DIR, f"{key}.json")
+# Hidden/starred changes go through a group commit: a request queues its
+# operations, and whichever request next holds the lock applies everything
+# queued so far in one transaction, so a burst of clicks is one write.
+#
+# Reads are served from an in-process cache of each key's value, lastModified
+# and version; the write path drops the keys it changes (under the lock, so a
+# concurrent read cannot put an old value back). The versions alone are also
+# kept apart from the values and re-read after every write, which is one
+# small query, so ETags and /changes tokens never reload a whole list. The
+# API runs as a single process, so no other writer can leave the cache stale,
+# and an unchanged GET /user-state is a 304 built from the versions alone.
+USER_STATE_DB = os.path.join(USER_STATE_DIR, "state.db")
+_state_db = user_state_store.open_store(USER_STATE_DB, legacy_dir=USER_STATE_DIR)
+_state_lock = threading.Lock()
+# keys returned by GET /user-state
+STATE_KEYS = ("hidden", "starred", "settings")
+# state lists and the timestamp field of their entries
+STATE_LISTS = {"hidden": "hiddenAt", "starred": "starredAt"}
+MAX_BATCH_OPS = 1000
+_state_queue = []  # {"ops", "done", "time", "error"} waiting for a commit
+_state_queue_lock = threading.Lock()
+_state_cache = {}  # key → {"value", "lastModified", "version"}; do not mutate
+# key → version of every stored key; replaced, never mutated, under the lock
+_state_versions = user_state_store.versions(_state_db)
+# (state token before, state token after, client id) of the last state write,
+# so /changes can tell a client its own write apart from someone else's; the
+# client id is None when the write carried several clients' changes
+_last_state_write = (None, None, None)
 
 
 def _load_state(key):
-    path = _user_state_path(key)
-    if not os.path.exists(path):
-        return {"value": None, "lastModified": None}
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    state = _state_cache.get(key)
+    if state is None:
+        with _state_lock:
+            state = _state_cache.get(key)
+            if state is None:
+                state = _state_cache[key] = user_state_store.load(_state_db, key)
+    return state
+
+
+def _state_etag(versions):
+    """ETag of GET /user-state: the versions of all STATE_KEYS."""
+    return "v" + ".".join(str(versions.get(key, 0)) for key in STATE_KEYS)
+
+
+def _state_token():
+    """_state_etag() of the current state."""
+    return _state_etag(_state_versions)
+
+
+def _record_state_write(before, client):
+    """Re-read the versions after a write and remember who made the write
+    that moved the state past `before`; the caller holds _state_lock."""
+    global _last_state_write, _state_versions
+    _state_versions = user_state_store.versions(_state_db)
+    _last_state_write = (before, _state_token(), client)
+
+
+def _is_own_state_write(known, current, client):
+    """True if the state went from `known` to `current` by one write of client."""
+    return client is not None and _last_state_write == (known, current, client)
 
 
-def _save_state(key, value):
+def _save_state(changes, client=None):
+    """Replace the values of the keys in changes; returns the server time."""
     now = datetime.now(timezone.utc).isoformat()
-    data = {"value": value, "lastModified": now}
-    with open(_user_state_path(key), "w", encoding="utf-8") as f:
-        json.dump(data, f)
+    with _state_lock:
+        before = _state_token()
+        try:
+            for key, value in changes.items():
+                try:
+                    user_state_store.save(_state_db, key, value, now)
+                finally:
+                    _state_cache.pop(key, None)
+        finally:
+            _record_state_write(before, client)
+    _notify_changes()
     return now
 
 
+def _commit_state_ops(ops, client=None):
+    """Apply list operations with whatever other requests have queued; returns
+    the server time of the commit that included them."""
+    slot = {"ops": ops, "client": client, "done": False, "time": None, "error": None}
+    with _state_queue_lock:
+        _state_queue.append(slot)
+    with _state_lock:
+        if not slot["done"]:
+            with _state_queue_lock:
+                group = _state_queue[:]
+                _state_queue.clear()
+            now = datetime.now(timezone.utc).isoformat()
+            ops = [op for queued in group for op in queued["ops"]]
+            before = _state_token()
+            try:
+                user_state_store.apply_ops(_state_db, ops, now, STATE_LISTS)
+            except Exception:
+                # commit the requests one by one, so a rejected one does not
+                # fail the others it was grouped with
+                for queued in group:
+                    try:
+                        user_state_store.apply_ops(
+                            _state_db, queued["ops"], now, STATE_LISTS
+                        )
+                    except Exception as e:
+                        queued["error"] = e
+            for key, _, _ in ops:
+                _state_cache.pop(key, None)
+            clients = {queued["client"] for queued in group}
+            _record_state_write(before, clients.pop() if len(clients) == 1 else None)
+            for queued in group:
+                queued["time"] = now
+                queued["done"] = True
+    _notify_changes()
+    if slot["error"] is not None:
+        raise slot["error"]
+    return slot["time"]
+
+
+def _parse_state_op(op, key=None):
+    """Turn a request's {key, action, id, <key>At} into a store operation."""
+    if not isinstance(op, dict):
+        abort(400, description="Invalid operation")
+    key = key or op.get("key")
+    if key not in STATE_LISTS:
+        abort(400, description="Invalid key")
+    id_ = op.get("id")
+    if not isinstance(id_, str):
+        abort(400, description="Invalid id")
+    action = op.get("action")
+    if action == "add":
+        stamp_field = STATE_LISTS[key]
+        return key, "add", {"id": id_, stamp_field: op.get(stamp_field)}
+    if action == "remove":
+        return key, "remove", id_
+    abort(400, description="Invalid action")
+
+
 @app.route("/user-state", methods=["GET"])
 def get_user_state():
     """Delta‐fetch: only return keys changed since `since`."""
     since = request.args.get("since")
+    etag = _state_token()
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+    states = {key: _load_state(key) for key in STATE_KEYS}
+    # a write may have landed since the check; tag what is actually returned
+    etag = _state_etag({key: st["version"] for key, st in states.items()})
     out = {}
     newest = since
-    for key in ("hidden", "starred", "settings"):
-        st = _load_state(key)
-        lm = st.get("lastModified")
+    for key, st in states.items():
+        lm = st["lastModified"]
         if lm and (not since or lm > since):
             out[key] = st["value"]
             if not newest or lm > newest:
                 newest = lm
-    if_none = request.headers.get("If-None-Match")
-    etag = newest or ""
-    if if_none == etag:
-        return ("", 304)
     resp = jsonify({"changes": out, "serverTime": newest})
-    resp.headers["ETag"] = etag
+    resp.set_etag(etag)
     return resp, 200
 
 
@@ -210,49 +744,129 @@ def post_user_state():
         return jsonify({"error": "Invalid or missing JSON body"}), 400
 
     server_time = None
-    for key, val in data["changes"].items():
-        # merge arrays or overwrite settings
-        current = _load_state(key)["value"] or ({} if key == "settings" else [])
-        if isinstance(current, list) and isinstance(val, list):
-            merged = val
-        else:
-            merged = val
-        server_time = _save_state(key, merged)
+    if data["changes"]:
+        # client values replace arrays and settings alike
+        server_time = _save_state(data["changes"], request.headers.get("X-Client-Id"))
 
     return jsonify({"serverTime": server_time}), 200
 @app.route("/user-state/hidden/delta", methods=["POST"])
 def hidden_delta():
-    data    = request.get_json(force=True)
-    state   = _load_state("hidden")["value"] or []
-    action  = data.get("action")
-    id_     = data.get("id")
-    if action == "add":
-        entry = {"id": id_, "hiddenAt": data.get("hiddenAt")}
-        if all(h["id"] != id_ for h in state):
-            state.append(entry)
-    elif action == "remove":
-        state = [h for h in state if h["id"] != id_]
-    else:
-        abort(400, description="Invalid action")
-    server_time = _save_state("hidden", state)
-    return jsonify({"serverTime": server_time}), 200
+    return _list_delta("hidden")
 
 @app.route("/user-state/starred/delta", methods=["POST"])
 def starred_delta():
-    data    = request.get_json(force=True)
-    state   = _load_state("starred")["value"] or []
-    action  = data.get("action")
-    id_     = data.get("id")
-    if action == "add":
-        entry = {"id": id_, "starredAt": data.get("starredAt")}
-        if all(s["id"] != id_ for s in state):
-            state.append(entry)
-    elif action == "remove":
-        state = [s for s in state if s["id"] != id_]
-    else:
-        abort(400, description="Invalid action")
-    server_time = _save_state("starred", state)
+    return _list_delta("starred")
+
+
+def _list_delta(key):
+    """Add or remove one {"id", <key>At} entry of a state list."""
+    data = request.get_json(force=True)
+    try:
+        server_time = _commit_state_ops(
+            [_parse_state_op(data, key)], request.headers.get("X-Client-Id")
+        )
+    except user_state_store.InvalidStateValue as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"serverTime": server_time}), 200
+
+
+@app.route("/user-state/batch", methods=["POST"])
+def state_batch():
+    """Apply {"ops": [{key, action, id, hiddenAt|starredAt}, ...]} in order,
+    all or nothing."""
+    data = request.get_json(silent=True)
+    ops = data.get("ops") if isinstance(data, dict) else None
+    if not isinstance(ops, list) or len(ops) > MAX_BATCH_OPS:
+        return jsonify({"error": "Invalid or missing ops"}), 400
+    parsed = [_parse_state_op(op) for op in ops]
+    try:
+        server_time = (
+            _commit_state_ops(parsed, request.headers.get("X-Client-Id"))
+            if parsed
+            else None
+        )
+    except user_state_store.InvalidStateValue as e:
+        return jsonify({"error": str(e)}), 409
     return jsonify({"serverTime": server_time}), 200
 
+
+# ─── Change notification ───────────────────────────────────────────────────
+# GET /changes is a long poll: it answers as soon as the feed or the user
+# state differs from the version tokens the client passes, or after
+# CHANGES_TIMEOUT seconds, so clients sync right after a change instead of
+# on a timer. State writes wake waiters at once; a new feed snapshot (written
+# by the pipeline, another process) is picked up every CHANGES_TICK seconds
+# with a stat. Each waiter holds a server thread, so only MAX_CHANGE_WAITERS
+# wait at a time; others are answered at once and fall back to polling.
+CHANGES_TIMEOUT = 25  # seconds
+CHANGES_TICK = 1  # seconds
+MAX_CHANGE_WAITERS = 4
+_changes_cond = threading.Condition()
+_change_waiters = 0
+# callables run after every state write, e.g. to wake asgi.py's waiters
+_change_listeners = []
+
+
+def _notify_changes():
+    with _changes_cond:
+        _changes_cond.notify_all()
+    for listener in _change_listeners:
+        listener()
+
+
+def _is_change(known, current, client):
+    """Whether a client that knew `known` should sync for `current`: not when
+    the only difference is the client's own state write."""
+    return current["feed"] != known["feed"] or not _is_own_state_write(
+        known["state"], current["state"], client
+    )
+
+
+def _current_versions():
+    """Return the {"feed", "state"} version tokens /changes compares."""
+    index = _get_feed_index()
+    state = _state_token()
+    # feed.xml without a snapshot has no generation; its GUID list stands in
+    feed = index["generation"] if index["generation"] is not None else index["guids_etag"]
+    return {"feed": str(feed), "state": state}
+
+
+@app.route("/changes", methods=["GET"])
+def changes():
+    """Wait until ?feed= or ?state= is out of date, then return both current
+    tokens; returns at once when they are missing (the first call).
+
+    With ?client=<id>, the X-Client-Id of the caller's writes, a change that
+    is only that client's own state write is returned with "changed": false.
+    """
+    global _change_waiters
+    feed = request.args.get("feed")
+    state = request.args.get("state") or None
+    client = request.args.get("client") or None
+    known = {"feed": feed, "state": state}
+    current = _current_versions()
+    if feed is None or current != known:
+        changed = feed is not None and _is_change(known, current, client)
+        return jsonify({**current, "changed": changed}), 200
+
+    with _changes_cond:
+        if _change_waiters >= MAX_CHANGE_WAITERS:
+            return jsonify({**current, "changed": False, "busy": True}), 200
+        _change_waiters += 1
+    try:
+        deadline = monotonic() + CHANGES_TIMEOUT
+        while current == known:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return jsonify({**current, "changed": False}), 200
+            with _changes_cond:
+                _changes_cond.wait(min(CHANGES_TICK, remaining))
+            current = _current_versions()
+    finally:
+        with _changes_cond:
+            _change_waiters -= 1
+    return jsonify({**current, "changed": _is_change(known, current, client)}), 200
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=3000)
@@ -0,0 +1,150 @@
+# ASGI entry point for the API, for serving with uvicorn:
+#   uvicorn --app-dir /app/www --no-proxy-headers asgi:app
+#
+# Connections are handled on an asyncio event loop, so idle and slow clients
+# cost no threads. /changes long polls wait on the loop itself; every other
+# request runs the Flask app from api.py through a2wsgi's WSGI adapter in a
+# bounded thread pool, so file and SQLite work never blocks the loop. The
+# WSGI entry point (gunicorn api:app) keeps working unchanged.
+
+import asyncio
+import json
+import os
+import sys
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import api
+
+# threads running Flask requests
+API_THREADS = int(os.environ.get("API_THREADS", "8"))
+
+_flask = WSGIMiddleware(api.app, workers=API_THREADS)
+# /changes state, owned by the event loop: the current version tokens, a
+# condition notified when they change, an event that ends a tick early and
+# one set once the first tokens are known
+_versions = None
+_versions_changed = None
+_wake = None
+_ready = None
+_watcher = None
+
+
+def _blocking(func, *args):
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def _start_watcher():
+    """Start the version watcher once and wait for the first tokens.
+
+    Runs at lifespan startup, or on the first /changes request when the
+    server runs with lifespan events off.
+    """
+    global _versions_changed, _wake, _ready, _watcher
+    if _watcher is None:
+        _versions_changed = asyncio.Condition()
+        _wake = asyncio.Event()
+        _ready = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        api._change_listeners.append(lambda: loop.call_soon_threadsafe(_wake.set))
+        _watcher = asyncio.create_task(_watch_versions())
+    await _ready.wait()
+
+
+async def _shutdown():
+    if _watcher is not None:
+        _watcher.cancel()
+
+
+async def _watch_versions():
+    """Recompute the version tokens once per tick, or at once after a state
+    write, and wake the /changes waiters when they differ. One check serves
+    every waiting client."""
+    global _versions
+    while _versions is None:
+        try:
+            _versions = await _blocking(api._current_versions)
+        except Exception as e:
+            print(f"Change watcher failed: {e}", file=sys.stderr)
+            await asyncio.sleep(api.CHANGES_TICK)
+    _ready.set()
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), api.CHANGES_TICK)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            versions = await _blocking(api._current_versions)
+        except Exception as e:
+            print(f"Change watcher failed: {e}", file=sys.stderr)
+            continue
+        if versions != _versions:
+            _versions = versions
+            async with _versions_changed:
+                _versions_changed.notify_all()
+
+
+async def _changes(scope, send):
+    """Async twin of api.changes(): no thread is held while waiting."""
+    await _start_watcher()
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    feed = query.get("feed", [None])[0]
+    known = {"feed": feed, "state": query.get("state", [""])[0] or None}
+    client = query.get("client", [""])[0] or None
+    if feed is None or _versions != known:
+        changed = feed is not None and api._is_change(known, _versions, client)
+        body = {**_versions, "changed": changed}
+    else:
+        async with _versions_changed:
+            try:
+                await asyncio.wait_for(
+                    _versions_changed.wait_for(lambda: _versions != known),
+                    api.CHANGES_TIMEOUT,
+                )
+                changed = api._is_change(known, _versions, client)
+            except asyncio.TimeoutError:
+                changed = False
+        body = {**_versions, "changed": changed}
+    body = json.dumps(body).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def _merge_cookies(scope):
+    """Join split Cookie headers with "; " (RFC 9113 8.2.3); the WSGI adapter
+    joins repeated headers with ",", which would corrupt them."""
+    cookies = [value for name, value in scope["headers"] if name == b"cookie"]
+    if len(cookies) < 2:
+        return scope
+    headers = [(name, value) for name, value in scope["headers"] if name != b"cookie"]
+    return {**scope, "headers": headers + [(b"cookie", b"; ".join(cookies))]}
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await _start_watcher()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await _shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/changes" and scope["method"] == "GET":
+        await _changes(scope, send)
+    else:
+        await _flask(_merge_cookies(scope), receive, send)
@@ -17,7 +17,7 @@ if ('serviceWorker' in navigator) {
 
 import {
   dbPromise, bufferedChanges, pushUserState, performSync, performFullSync, pullUserState, processPendingOperations,
-  isStarred, toggleStar, isHidden, toggleHidden, loadHidden, loadStarred, pruneStaleHidden
+  watchChanges, isWatchingChanges, isStarred, toggleStar, isHidden, toggleHidden, loadHidden, loadStarred, pruneStaleHidden
 } from "./js/database.js";
 import {
   scrollToTop, attachScrollToTopHandler, formatDate,
@@ -96,23 +96,34 @@ window.rssApp = () => {
         initScrollPos(this); // restore previous scroll position once entries are rendered
         this.loading = false;
         // 2) kick off one‑off background partial sync
+        const backgroundSync = async () => {
+          try {
+            await performSync();
+            await pullUserState(await dbPromise);
+            this.hidden = await loadHidden();
+            this.starred = await loadStarred();
+            // re‑load & re‑render using helper
+            const freshRaw = await db.transaction('items', 'readonly').objectStore('items').getAll();
+            this.entries = mapRawItems(freshRaw, this.formatDate);
+            this.hidden = await pruneStaleHidden(this.entries, Date.now());
+            this.updateCounts();
+          } catch (err) {
+            console.error('Background partial sync failed', err);
+          }
+        };
         if (this.syncEnabled) {
-          setTimeout(async () => {
-            try {
-              await performSync();
-              await pullUserState(await dbPromise);
-              this.hidden = await loadHidden();
-              this.starred = await loadStarred();
-              // re‑load & re‑render using helper
-              const freshRaw = await db.transaction('items', 'readonly').objectStore('items').getAll();
-              this.entries = mapRawItems(freshRaw, this.formatDate);
-              this.hidden = await pruneStaleHidden(this.entries, Date.now());
-              this.updateCounts();
-            } catch (err) {
-              console.error('Background partial sync failed', err);
-            }
-          }, 0);
+          setTimeout(backgroundSync, 0);
         }
+        // 3) sync again whenever the server reports a new feed or user state;
+        //    changes arriving in quick succession share one sync
+        const CHANGE_SYNC_DELAY = 2000;
+        let changeSyncTimer = null;
+        const scheduleSync = () => {
+          clearTimeout(changeSyncTimer);
+          changeSyncTimer = setTimeout(backgroundSync, CHANGE_SYNC_DELAY);
+        };
+        watchChanges(scheduleSync,
+          () => this.syncEnabled && this.isOnline && !document.hidden);
         this._attachScrollToTopHandler();
         // ─── user activity / idle detection ───────────────────────────
         let lastActivity = Date.now();
@@ -132,7 +143,8 @@ window.rssApp = () => {
             this.openSettings ||
             !this.syncEnabled ||
             document.hidden ||
-            (now - lastActivity) > IDLE_THRESHOLD
+            (now - lastActivity) > IDLE_THRESHOLD ||
+            isWatchingChanges() // change notifications make polling unnecessary
           ) {
             return;
           }
@@ -5,6 +5,12 @@ export const bufferedChanges = [];
 // queue for operations to retry when back online
 export const pendingOperations = [];
 
+// identifies this page's state writes, so its own /changes long poll is not
+// woken by them
+const CLIENT_ID = crypto.randomUUID
+  ? crypto.randomUUID()
+  : Math.random().toString(36).slice(2);
+
 // helper to detect network state
 export function isOnline() {
   return navigator.onLine;
@@ -39,6 +45,33 @@ async function fetchWithRetry(url, options = {}, retries = 3, backoff = 500) {
   }
 }
 
+/**
+ * Return the server's current GUID list, using /guids?since=<generation>
+ * to download only what changed since the last sync.
+ */
+async function fetchServerGuids(db) {
+  const generation = await db.get('userState', 'feedGeneration');
+  const cached = await db.get('userState', 'feedGuids');
+  const since = generation && cached ? generation.value : '';
+  const res = await fetchWithRetry(`/guids?since=${encodeURIComponent(since)}`)
+    .then(r => r.json());
+
+  let guids;
+  if (res.guids) {
+    guids = res.guids;
+  } else {
+    const current = new Set(JSON.parse(cached.value));
+    res.removed.forEach(g => current.delete(g));
+    res.added.forEach(g => current.add(g));
+    guids = [...current];
+  }
+  const tx = db.transaction('userState', 'readwrite');
+  tx.objectStore('userState').put({ key: 'feedGeneration', value: res.generation });
+  tx.objectStore('userState').put({ key: 'feedGuids', value: JSON.stringify(guids) });
+  await tx.done;
+  return guids;
+}
+
 /**
  * Perform diff‐based sync using /items endpoints.
  */
@@ -56,8 +89,10 @@ export async function performSync() {
   const serverTime = Date.parse(serverTimeStr);
   const staleCutoff = serverTime - 30 * 86400 * 1000;
 
-  // 2) fetch full GUID list
-  const serverGuids = await fetchWithRetry('/guids').then(r => r.json());
+  // 2) fetch the GUID list: only the changes since the feed generation we
+  //    last saw, or the full list when the server can no longer diff from it
+  const serverGuids = await fetchServerGuids(db);
+  const serverGuidSet = new Set(serverGuids);
 
   // 3) load local items
   const txRead = db.transaction('items', 'readonly');
@@ -66,7 +101,7 @@ export async function performSync() {
 
   // 4) delete any items no longer on server AND older than 30d
   const toDelete = localItems
-    .filter(it => !serverGuids.includes(it.guid) && it.lastSync < staleCutoff)
+    .filter(it => !serverGuidSet.has(it.guid) && it.lastSync < staleCutoff)
     .map(it => it.guid);
   if (toDelete.length) {
     const txDel = db.transaction('items', 'readwrite');
@@ -111,6 +146,56 @@ export async function performSync() {
   return serverTime;
 }
 
+// ─── Change notification ───────────────────────────────────────────────────
+const CHANGE_RETRY_MAX = 60 * 1000;
+const CHANGE_BUSY_BACKOFF = 5 * 60 * 1000;
+let lastChangeResponse = 0;
+
+/** True while /changes long polls are being answered normally. */
+export function isWatchingChanges() {
+  // the server answers within 25 s; allow for one slow round trip
+  return Date.now() - lastChangeResponse < 60 * 1000;
+}
+
+/**
+ * Long-poll /changes for as long as the page is open and call onChange()
+ * whenever the server reports a new feed generation or a user-state write
+ * made elsewhere. Polling pauses while shouldWatch() is false.
+ */
+export async function watchChanges(onChange, shouldWatch) {
+  let tokens = null;
+  let retryDelay = 1000;
+  const sleep = ms => new Promise(r => setTimeout(r, ms));
+  for (;;) {
+    if (!shouldWatch()) {
+      await sleep(5000);
+      continue;
+    }
+    try {
+      const query = tokens
+        ? `?feed=${encodeURIComponent(tokens.feed)}&state=${encodeURIComponent(tokens.state ?? '')}`
+          + `&client=${encodeURIComponent(CLIENT_ID)}`
+        : '';
+      const res = await fetchWithRetry(`/changes${query}`);
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      const data = await res.json();
+      tokens = { feed: data.feed, state: data.state };
+      retryDelay = 1000;
+      if (data.busy) {
+        // no free waiting slot on the server: leave it to the sync timer
+        await sleep(CHANGE_BUSY_BACKOFF);
+        continue;
+      }
+      lastChangeResponse = Date.now();
+      if (data.changed) await onChange();
+    } catch (err) {
+      console.warn('Change notification failed, retrying', err);
+      await sleep(retryDelay);
+      retryDelay = Math.min(retryDelay * 2, CHANGE_RETRY_MAX);
+    }
+  }
+}
+
 // ─── Delta‐based user‐state sync ───────────────────────────────────────────
 /** Fetch only the keys changed since lastStateSync */
 export async function pullUserState(db) {
@@ -120,8 +205,10 @@ export async function pullUserState(db) {
   }
   const meta = await db.get('userState', 'lastStateSync') || { value: null };
   const since = meta.value;
+  // the ETag names the server's state versions, so nothing changed → 304
+  const etag = await db.get('userState', 'userStateEtag');
   const headers = {};
-  if (since) headers['If-None-Match'] = since;
+  if (since && etag) headers['If-None-Match'] = etag.value;
   const res = await fetch('/user-state?since=' + encodeURIComponent(since || ''), { headers });
   if (res.status === 304) return meta.value;
   const { changes, serverTime } = await res.json();
@@ -130,6 +217,7 @@ export async function pullUserState(db) {
     tx.objectStore('userState').put({ key, value: JSON.stringify(val) });
   }
   tx.objectStore('userState').put({ key: 'lastStateSync', value: serverTime });
+  tx.objectStore('userState').put({ key: 'userStateEtag', value: res.headers.get('ETag') });
   await tx.done;
   return serverTime;
 }
@@ -157,7 +245,8 @@ export async function pushUserState(db, buffered = bufferedChanges) {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
-      'Accept': 'application/json'
+      'Accept': 'application/json',
+      'X-Client-Id': CLIENT_ID
     },
     body: payload,
   });
@@ -184,6 +273,114 @@ export async function performFullSync() {
 }
 
 
+// -------- Batched hidden/starred changes --------
+// Changes made within STATE_FLUSH_DELAY ms of each other are sent as one
+// POST /user-state/batch, in the order they were made.
+const STATE_FLUSH_DELAY = 300;
+// ops per batch request; must not exceed MAX_BATCH_OPS in api.py
+const MAX_STATE_BATCH = 1000;
+const outgoingStateOps = [];
+let stateFlushTimer = null;
+
+// the server rejects a whole batch for one malformed op, so ops are checked
+// before they are queued
+function isValidStateOp(op) {
+  return (
+    (op.key === 'hidden' || op.key === 'starred') &&
+    typeof op.id === 'string' &&
+    (op.action === 'add' || op.action === 'remove')
+  );
+}
+
+function queueStateOp(op) {
+  if (!isValidStateOp(op)) {
+    console.warn('Dropping invalid state change', op);
+    return;
+  }
+  outgoingStateOps.push(op);
+  if (!stateFlushTimer) {
+    stateFlushTimer = setTimeout(flushStateOps, STATE_FLUSH_DELAY);
+  }
+}
+
+/**
+ * Send ops in batches of at most MAX_STATE_BATCH, in order. Returns the ops
+ * that should be retried later: everything from the first batch that failed
+ * on the network or with a server error. A batch the server rejects (4xx)
+ * would be rejected again, so it is logged and dropped.
+ */
+async function postStateOps(ops) {
+  for (let i = 0; i < ops.length; i += MAX_STATE_BATCH) {
+    let res;
+    try {
+      res = await fetchWithRetry('/user-state/batch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Client-Id': CLIENT_ID },
+        body: JSON.stringify({ ops: ops.slice(i, i + MAX_STATE_BATCH) })
+      });
+    } catch (err) {
+      console.error('Failed to sync state changes:', err);
+      return ops.slice(i);
+    }
+    if (res.status >= 500) {
+      console.error(`State batch failed ${res.status}, will retry`);
+      return ops.slice(i);
+    }
+    if (!res.ok) {
+      console.error(`State batch rejected ${res.status}:`, await res.text());
+    }
+  }
+  return [];
+}
+
+async function flushStateOps() {
+  stateFlushTimer = null;
+  const ops = outgoingStateOps.splice(0);
+  if (ops.length === 0) return;
+  const unsent = isOnline() ? await postStateOps(ops) : ops;
+  unsent.forEach(op => pendingOperations.push({ type: 'stateOp', data: op }));
+  if (unsent.length > 0) {
+    console.log(`Queued ${unsent.length} state change(s) for later sync`);
+  }
+}
+
+/**
+ * Send queued ops at once when the page is hidden or unloaded, instead of
+ * losing them with the flush timer. keepalive lets the requests outlive the
+ * page; if it stays open, ops that fail are queued for the next sync.
+ */
+function flushStateOpsNow() {
+  clearTimeout(stateFlushTimer);
+  stateFlushTimer = null;
+  const ops = outgoingStateOps.splice(0);
+  if (ops.length === 0) return;
+  const retryLater = batch =>
+    batch.forEach(op => pendingOperations.push({ type: 'stateOp', data: op }));
+  if (!isOnline()) {
+    retryLater(ops);
+    return;
+  }
+  for (let i = 0; i < ops.length; i += MAX_STATE_BATCH) {
+    const batch = ops.slice(i, i + MAX_STATE_BATCH);
+    fetch('/user-state/batch', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-Client-Id': CLIENT_ID },
+      body: JSON.stringify({ ops: batch }),
+      keepalive: true
+    }).then(res => {
+      if (res.status >= 500) retryLater(batch);
+    }).catch(err => {
+      console.error('Failed to sync state changes:', err);
+      retryLater(batch);
+    });
+  }
+}
+
+window.addEventListener('pagehide', flushStateOpsNow);
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') flushStateOpsNow();
+});
+
 // -------- STARRED support --------
 /**
  * @param {Object} state  The Alpine component `this`
@@ -215,22 +412,7 @@ export async function toggleStar(state, link) {
   if (typeof state.updateCounts === 'function') {
     state.updateCounts();
   }
-  const delta = { id: link, action, starredAt };
-  if (!isOnline()) {
-    pendingOperations.push({ type: 'starDelta', data: delta });
-    console.log(`Offline: queued star change (${action})`);
-  } else {
-    try {
-      await fetch("/user-state/starred/delta", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(delta)
-      });
-    } catch (err) {
-      console.error("Failed to sync star change:", err);
-      pendingOperations.push({ type: 'starDelta', data: delta });
-    }
-  }
+  queueStateOp({ key: 'starred', id: link, action, starredAt });
 }
 
 
@@ -269,23 +451,7 @@ export async function toggleHidden(state, link) {
   if (typeof state.updateCounts === 'function') {
     state.updateCounts();
   }
-  // fire off single‐item delta for hidden
-  const delta = { id: link, action, hiddenAt };
-  if (!isOnline()) {
-    pendingOperations.push({ type: 'hiddenDelta', data: delta });
-    console.log(`Offline: queued hidden change (${action})`);
-  } else {
-    try {
-      await fetch("/user-state/hidden/delta", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(delta)
-      });
-    } catch (err) {
-      console.error("Failed to sync hidden change:", err);
-      pendingOperations.push({ type: 'hiddenDelta', data: delta });
-    }
-  }
+  queueStateOp({ key: 'hidden', id: link, action, hiddenAt });
 }
 
 /**
@@ -416,26 +582,26 @@ export async function pruneStaleHidden(entries, serverTime) {
 export async function processPendingOperations() {
   if (!isOnline() || pendingOperations.length === 0) return;
   const ops = pendingOperations.splice(0);
+  // consecutive hidden/starred changes are replayed as batch requests
+  let batch = [];
+  const flushBatch = async () => {
+    if (batch.length === 0) return;
+    const queued = batch;
+    batch = [];
+    const unsent = await postStateOps(queued.map(op => op.data));
+    unsent.forEach(data => pendingOperations.push({ type: 'stateOp', data }));
+  };
   for (const op of ops) {
+    if (op.type === 'stateOp') {
+      batch.push(op);
+      continue;
+    }
+    await flushBatch();
     try {
       switch (op.type) {
         case 'pushUserState':
           await pushUserState(await dbPromise, op.data);
           break;
-        case 'starDelta':
-          await fetch("/user-state/starred/delta", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(op.data)
-          });
-          break;
-        case 'hiddenDelta':
-          await fetch("/user-state/hidden/delta", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(op.data)
-          });
-          break;
         default:
           console.warn(`Unknown op: ${op.type}`);
       }
@@ -444,4 +610,5 @@ export async function processPendingOperations() {
       pendingOperations.push(op);
     }
   }
-}
\ No newline at end of file
+  await flushBatch();
+}
@@ -0,0 +1,184 @@
+# Persistent user state (hidden, starred, settings) for api.py.
+# Lists of {"id": ...} entries are kept one row per entry, keyed by
+# (key, id), so marking a single item hidden or starred is one indexed insert
+# or delete instead of rewriting the whole list. Any other value is stored
+# as JSON. Each change is one SQLite transaction, so readers never see a
+# half-written state, and bumps the key's version, a counter that only ever
+# increases and that api.py builds its ETags from.
+
+import json
+import os
+import sqlite3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    key           TEXT PRIMARY KEY,
+    value         TEXT,          -- JSON; NULL when kept in state_items
+    last_modified TEXT NOT NULL,
+    version       INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS state_items (
+    key  TEXT NOT NULL,
+    id   TEXT NOT NULL,
+    data TEXT NOT NULL,          -- the entry as JSON; rowid keeps list order
+    UNIQUE (key, id)
+);
+"""
+
+
+def open_store(path, legacy_dir=None):
+    """Open (and create if needed) the store at `path`.
+
+    Keys found as <key>.json files in `legacy_dir` but not yet in the store
+    are imported once.
+    """
+    # api.py shares one connection between its threads behind a lock
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(state)")]
+    if "version" not in columns:
+        # stores created before versions were kept
+        with conn:
+            conn.execute(
+                "ALTER TABLE state ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+            conn.execute("UPDATE state SET version = 1")
+    if legacy_dir:
+        _import_legacy(conn, legacy_dir)
+    return conn
+
+
+def _import_legacy(conn, legacy_dir):
+    for name in sorted(os.listdir(legacy_dir)):
+        key, ext = os.path.splitext(name)
+        if ext != ".json" or load(conn, key)["lastModified"] is not None:
+            continue
+        try:
+            with open(os.path.join(legacy_dir, name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            save(conn, key, data["value"], data["lastModified"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Skipping user state file {name}: {e}")
+
+
+def _is_entry_list(value):
+    return isinstance(value, list) and all(
+        isinstance(item, dict) and isinstance(item.get("id"), str) for item in value
+    )
+
+
+def load(conn, key):
+    """Return {"value", "lastModified", "version"} for key; value and
+    lastModified are None and version is 0 if it was never set."""
+    row = conn.execute(
+        "SELECT value, last_modified, version FROM state WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return {"value": None, "lastModified": None, "version": 0}
+    value, last_modified, version = row
+    if value is None:
+        value = [
+            json.loads(data)
+            for (data,) in conn.execute(
+                "SELECT data FROM state_items WHERE key = ? ORDER BY rowid", (key,)
+            )
+        ]
+    else:
+        value = json.loads(value)
+    return {"value": value, "lastModified": last_modified, "version": version}
+
+
+def versions(conn):
+    """Return {key: version} for every stored key, without loading values."""
+    return dict(conn.execute("SELECT key, version FROM state"))
+
+
+def save(conn, key, value, now):
+    """Replace the whole value of key."""
+    with conn:
+        conn.execute("DELETE FROM state_items WHERE key = ?", (key,))
+        if _is_entry_list(value):
+            # a repeated id keeps its first entry
+            conn.executemany(
+                "INSERT OR IGNORE INTO state_items (key, id, data) VALUES (?, ?, ?)",
+                ((key, item["id"], json.dumps(item)) for item in value),
+            )
+            stored = None
+        else:
+            stored = json.dumps(value)
+        _write_state(conn, key, stored, now)
+
+
+def _write_state(conn, key, stored, now):
+    conn.execute(
+        "INSERT INTO state (key, value, last_modified, version) VALUES (?, ?, ?, 1)"
+        " ON CONFLICT (key) DO UPDATE SET value = excluded.value,"
+        " last_modified = excluded.last_modified, version = version + 1",
+        (key, stored, now),
+    )
+
+
+class InvalidStateValue(ValueError):
+    """A list operation hit a stored value that cannot be made an entry list."""
+
+
+def _as_entries(key, value, now, stamp_field):
+    """Convert a stored list to entries. Plain string ids (the format before
+    entries had timestamps) become {"id", <stamp_field>: now}, as the client's
+    own migration does; anything else is refused rather than dropped."""
+    if not isinstance(value, list):
+        raise InvalidStateValue(f"{key} holds a {type(value).__name__}, not a list")
+    entries = []
+    for item in value:
+        if isinstance(item, str):
+            item = {"id": item, stamp_field: now} if stamp_field else {"id": item}
+        elif not (isinstance(item, dict) and isinstance(item.get("id"), str)):
+            raise InvalidStateValue(f"{key} holds an entry without a string id")
+        entries.append(item)
+    return entries
+
+
+def _touch_list(conn, key, now, stamp_field=None):
+    """Mark key as modified, making it an entry list if it held another value."""
+    row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    if row is not None and row[0] is not None:
+        conn.executemany(
+            "INSERT OR IGNORE INTO state_items (key, id, data) VALUES (?, ?, ?)",
+            (
+                (key, item["id"], json.dumps(item))
+                for item in _as_entries(key, json.loads(row[0]), now, stamp_field)
+            ),
+        )
+    _write_state(conn, key, None, now)
+
+
+def apply_ops(conn, ops, now, stamp_fields=None):
+    """Apply (key, "add", entry) / (key, "remove", id) operations in order,
+    in one transaction. Every key an operation touches gets `now` as its
+    modification time. An added entry whose id is already in the list is
+    ignored, like the old delta endpoints did.
+
+    stamp_fields maps a key to the timestamp field its entries carry, for
+    converting legacy string ids. Raises InvalidStateValue, changing nothing,
+    if a touched key holds a value that is not a list of ids or entries.
+    """
+    stamp_fields = stamp_fields or {}
+    with conn:
+        touched = set()
+        for key, action, arg in ops:
+            if key not in touched:
+                _touch_list(conn, key, now, stamp_fields.get(key))
+                touched.add(key)
+            if action == "add":
+                conn.execute(
+                    "INSERT OR IGNORE INTO state_items (key, id, data) VALUES (?, ?, ?)",
+                    (key, arg["id"], json.dumps(arg)),
+                )
+            elif action == "remove":
+                conn.execute(
+                    "DELETE FROM state_items WHERE key = ? AND id = ?", (key, arg)
+                )
+            else:
+                raise ValueError(f"unknown action {action!r}")